@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Micro-benchmark of classify.py against the original wrl.test() logic
+# Checks both give the same verdicts on synthetic responses, then times them
+
+import sys
+import timeit
+import argparse
+import classify
+
+TEST_STRINGS = ['registry expiry date:', 'domain name:', 'creation date:', 'created date:']
+DOMAIN = 'example.com'
+DISCLAIMER = ('TERMS OF USE: You are not authorized to access or query our Whois database through the use of '
+                'electronic processes that are high-volume and automated except as reasonably necessary.\n')
+
+RESPONSES = {
+  'thick': ('Domain Name: EXAMPLE.COM\nRegistrar: Example Registrar\nRegistrant Name: REDACTED\n' * 20 +
+              DISCLAIMER * 100 + 'Creation Date: 1995-08-14T04:00:00Z\n'),
+  'thick_late': DISCLAIMER * 150 + 'Registry Expiry Date: 2028-08-13T04:00:00Z\nDomain Name: EXAMPLE.COM\n',
+  'banner': 'Query rate limit exceeded. Try again later.\n',
+  'nomatch': DISCLAIMER * 20 + 'No match for "EXAMPLE.COM".\n',
+  'notfound': 'Domain not found.\n' + DISCLAIMER * 20,
+  'empty': '',
+}
+
+
+# The original wrl.test() without debug output
+def legacyTest(rs, domain):
+  if len(rs) > 0:
+    for ts in TEST_STRINGS:
+      if ts in rs.lower() and domain in rs.lower():
+        return classify.TEST_PASS, ts
+
+    if "no match" in rs.lower() and domain in rs.lower():
+      return classify.TEST_NOMATCH, None
+
+    if "domain not found" in rs.lower():
+      return classify.TEST_NOMATCH, None
+
+  return classify.TEST_FAIL, None
+
+
+ap = argparse.ArgumentParser(description='Benchmark whois response classification')
+ap.add_argument('-n', '--number', dest='number', type=int, default=2000, help='Calls per response type')
+args = ap.parse_args()
+
+clf = classify.Classifier()
+for name, rs in RESPONSES.items():
+  old = legacyTest(rs, DOMAIN)
+  new = clf.classify(rs, 'whois.example', DOMAIN)
+  if old[0] != new[0] or (old[0] == classify.TEST_PASS and old[1] != new[1]):
+    print("Mismatch on " + name + " legacy:" + repr(old) + " classify:" + repr(new))
+    sys.exit(1)
+
+print("response,bytes,legacy_us,classify_us,speedup")
+for name, rs in RESPONSES.items():
+  old = timeit.timeit(lambda: legacyTest(rs, DOMAIN), number=args.number) / args.number * 1e6
+  new = timeit.timeit(lambda: clf.classify(rs, 'whois.example', DOMAIN), number=args.number) / args.number * 1e6
+  print(name + ',' + str(len(rs)) + ',' + '%.2f' % old + ',' + '%.2f' % new + ',' + '%.2f' % (old / new))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Load benchmark of wrl.py against whoisFarm.py
+#
+# For each farm size a farm is started and wrl.py runs the TESTS schedule against it in compressed time
+# One CSV line is printed per size
+#  servers, queries = farm endpoints and results written
+#  wall_s = run time of wrl.py, qps = queries per second between the first and last query
+#  cpu_s, cpu_pct = user plus system time of wrl.py and its share of wall_s
+#  rss_mb = peak resident memory of wrl.py
+#  drift_p50_ms, drift_p99_ms, drift_max_ms = how late each query was sent against rep 0 of its case
+#   plus rep times the case delay, the schedule wrl.py promises
+#  fail_pct = share of FAIL verdicts, the farm limits show up here
+#
+# Compare runs on the same host before and after a change, the farm runs on the same cores as wrl.py
+
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+import numpy as np
+
+WRL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wrl.py')
+FARM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'whoisFarm.py')
+COLUMNS = ['servers', 'queries', 'wall_s', 'qps', 'cpu_s', 'cpu_pct', 'rss_mb',
+           'drift_p50_ms', 'drift_p99_ms', 'drift_max_ms', 'fail_pct']
+
+
+# Returns dict of COLUMNS from the JSON Lines results file fname
+# delays = dict of case name to compressed delay in seconds
+def summarize(fname, delays):
+  sent = {} # (server, case) to list of (rep, send time)
+  fails = 0
+  with open(fname, 'r') as f:
+    for line in f:
+      rec = json.loads(line)
+      if 'event' in rec:
+        continue
+      sent.setdefault((rec['server'], rec['case']), []).append((rec['rep'], rec['ts'] - rec['latency']))
+      if rec['verdict'].startswith('FAIL'):
+        fails += 1
+
+  drift = []
+  times = []
+  for (server, case), reps in sent.items():
+    reps.sort()
+    r0, t0 = reps[0]
+    for rep, t in reps:
+      drift.append(t - t0 - (rep - r0) * delays[case])
+      times.append(t)
+
+  queries = len(drift)
+  drift = np.array(drift or [0.0]) * 1000
+  span = max(times) - min(times) if times else 0
+  return {'queries': queries, 'qps': round(queries / span, 1) if span else 0,
+          'drift_p50_ms': round(float(np.percentile(drift, 50)), 2),
+          'drift_p99_ms': round(float(np.percentile(drift, 99)), 2),
+          'drift_max_ms': round(float(drift.max()), 2),
+          'fail_pct': round(100.0 * fails / queries, 2) if queries else 0}
+
+
+# Runs wrl.py against a farm of n endpoints in directory d
+# Returns dict of COLUMNS
+def bench(n, d, args, delays):
+  subjects = os.path.join(d, 'farm.csv')
+  farm = subprocess.Popen([sys.executable, FARM, '-n', str(n), '-p', str(args.port), '-o', subjects,
+                           '--scale', str(args.speedup), '--seed', str(args.seed),
+                           '--latency', str(args.latency)], stdout=subprocess.PIPE, text=True)
+  try:
+    if not farm.stdout.readline().startswith('ready'):
+      raise RuntimeError('whoisFarm.py did not start')
+
+    cmd = [sys.executable, WRL, 'farm.csv', '--node', 'bench', '--speedup', str(args.speedup)]
+    if args.cases:
+      cmd += ['--cases', args.cases]
+    start = time.monotonic()
+    wrl = subprocess.Popen(cmd, cwd=d, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(wrl.pid, 0)
+    wall = time.monotonic() - start
+  finally:
+    farm.terminate()
+    farm.wait()
+
+  if os.waitstatus_to_exitcode(status) != 0:
+    raise RuntimeError('wrl.py exited with status ' + str(os.waitstatus_to_exitcode(status)))
+  rv = summarize(glob.glob(os.path.join(d, 'res_bench_*.jsonl'))[0], delays)
+  cpu = usage.ru_utime + usage.ru_stime
+  rv.update(servers=n, wall_s=round(wall, 2), cpu_s=round(cpu, 2), cpu_pct=round(100 * cpu / wall, 1),
+            rss_mb=round(usage.ru_maxrss / 1024.0, 1))
+  return rv
+
+
+# Returns dict of case name to delay of wrl.py TESTS compressed by speedup
+# wrl.py runs its CLI on import, so TESTS is read from its source
+def caseDelays(speedup):
+  import ast
+  with open(WRL, 'r') as f:
+    for node in ast.parse(f.read()).body:
+      if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'TESTS':
+        return dict((case, delay / speedup) for case, delay, cnt in ast.literal_eval(node.value))
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Benchmark wrl.py against a simulated WHOIS server farm')
+  ap.add_argument('-n', '--servers', dest='servers', type=str, default='10,100,500',
+                    help='Comma separated farm sizes to run')
+  ap.add_argument('-s', '--speedup', dest='speedup', type=float, default=3600,
+                    help='Time compression of the TESTS schedule, 3600 runs an hour of schedule per second')
+  ap.add_argument('-c', '--cases', dest='cases', type=str, default=None, help='Comma separated cases of TESTS to run')
+  ap.add_argument('-p', '--port', dest='port', type=int, default=20000, help='Port of the first farm endpoint')
+  ap.add_argument('--seed', dest='seed', type=int, default=0, help='Seed of the farm profiles')
+  ap.add_argument('--latency', dest='latency', type=float, default=0.05, help='Median farm response delay in seconds')
+  ap.add_argument('-k', '--keep', dest='keep', action='store_true', default=False,
+                    help='Keep the result and debug files of each run')
+  args = ap.parse_args()
+
+  delays = caseDelays(args.speedup)
+  print(','.join(COLUMNS), flush=True)
+  for n in [int(x) for x in args.servers.split(',')]:
+    d = tempfile.mkdtemp(prefix='benchWrl_' + str(n) + '_')
+    try:
+      rv = bench(n, d, args, delays)
+    finally:
+      if args.keep:
+        print("Kept " + d, file=sys.stderr)
+      else:
+        shutil.rmtree(d)
+    print(','.join(str(rv[c]) for c in COLUMNS), flush=True)
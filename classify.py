@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Classification of whois responses against indicator profiles
+#
+# An indicator profile has three lists of lowercase strings
+#  pass = registrant data strings, in priority order, domain must also appear
+#  noma_domain = no match strings, domain must also appear
+#  noma = no match strings on their own
+#
+# Profiles can be loaded from a JSON file keyed by 'default', TLD of the queried domain or whois server FQDN
+# Lists missing from a profile are taken from 'default', e.g.
+# {"default": {"pass": ["domain name:"]},
+#  "de": {"pass": ["status: connect"], "noma": ["status: free"]},
+#  "whois.nic.example": {"noma_domain": ["not registered"]}}
+#
+# Responses can also be matched while they are read, see StreamMatcher
+# RDAP lookups are classified by HTTP status and the returned domain object instead, see classifyRdap()
+
+import json
+import codecs
+
+# 3 possible results for each test
+TEST_FAIL = 0
+TEST_PASS = 1
+TEST_NOMATCH = 2
+
+DEFAULT_PROFILE = {
+  'pass': ['registry expiry date:', 'domain name:', 'creation date:', 'created date:'],
+  'noma_domain': ['no match'],
+  'noma': ['domain not found'],
+}
+
+
+# Matcher for one indicator profile
+# The response is lowercased once and each indicator is a C level substring search on it
+# This measured several times faster than one combined regex, see benchClassify.py
+class Matcher():
+  def __init__(self, profile):
+    self.passInd = [s.lower() for s in profile['pass']]
+    self.nomaDomInd = [s.lower() for s in profile['noma_domain']]
+    self.nomaInd = [s.lower() for s in profile['noma']]
+
+  # Returns (verdict, matched indicator or None)
+  def classify(self, rs, domain):
+    if len(rs) == 0:
+      return TEST_FAIL, None
+
+    low = rs.lower()
+    if domain in low:
+      for ind in self.passInd:
+        if ind in low:
+          return TEST_PASS, ind
+      for ind in self.nomaDomInd:
+        if ind in low:
+          return TEST_NOMATCH, ind
+
+    for ind in self.nomaInd:
+      if ind in low:
+        return TEST_NOMATCH, ind
+    return TEST_FAIL, None
+
+  # Returns StreamMatcher for a response about domain
+  def stream(self, domain):
+    return StreamMatcher(self, domain)
+
+
+# Decides while a response is read whether the rest of it can change its verdict and indicator
+# Only PASS is certain early, more text can turn NOMA or FAIL into PASS but never the reverse
+# Matcher.classify() tags PASS with the first pass indicator in priority order found anywhere in the response,
+# so reading stops only once the domain and the first indicator of the list have been seen
+# A prefix ending once feed() returns True then classifies exactly like the whole response would
+class StreamMatcher():
+  def __init__(self, matcher, domain):
+    self.matcher = matcher
+    self.domain = domain
+    self.first = matcher.passInd[0] if matcher.passInd else None
+    self.keep = max([len(s) for s in matcher.passInd] + [len(domain)]) - 1 # Overlap so matches can span chunks
+    self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    self.tail = ''
+    self.sawDomain = False
+    self.sawFirst = False
+
+  # Add the next chunk of response bytes
+  # Returns True once the verdict and its indicator are certain
+  def feed(self, chunk):
+    if self.first is None:
+      return False
+    text = self.tail + self.decoder.decode(chunk).lower()
+    if not self.sawDomain:
+      self.sawDomain = self.domain in text
+    if not self.sawFirst:
+      self.sawFirst = self.first in text
+    self.tail = text[-self.keep:] if self.keep > 0 else ''
+    return self.sawDomain and self.sawFirst
+
+
+# Picks the Matcher for each whois server
+class Classifier():
+  def __init__(self, profiles=None):
+    profiles = profiles or {}
+    default = dict(DEFAULT_PROFILE)
+    default.update(profiles.get('default', {}))
+
+    self.default = Matcher(default)
+    self.matchers = {}
+    for key, prof in profiles.items():
+      if key == 'default':
+        continue
+      p = dict(default)
+      p.update(prof)
+      self.matchers[key.lower().strip('.')] = Matcher(p)
+
+  # Returns Matcher for server, falling back to TLD of domain then default
+  def matcher(self, server, domain):
+    if not self.matchers:
+      return self.default
+    server = server.lower().split(':')[0]
+    if server in self.matchers:
+      return self.matchers[server]
+    return self.matchers.get(domain.lower().split('.')[-1], self.default)
+
+  # Returns (verdict, matched indicator or None)
+  def classify(self, rs, server, domain):
+    return self.matcher(server, domain).classify(rs, domain)
+
+
+# Returns (verdict, indicator or None) of an RDAP domain lookup, see rdapClient.py
+# 200 with the domain object of domain passes, 404 is no match, anything else including 429 fails
+def classifyRdap(status, body, domain):
+  if status == 404:
+    return TEST_NOMATCH, 'rdap 404'
+  if status != 200:
+    return TEST_FAIL, None
+  try:
+    obj = json.loads(body)
+  except ValueError:
+    return TEST_FAIL, None
+  if not isinstance(obj, dict) or obj.get('objectClassName') != 'domain':
+    return TEST_FAIL, None
+  names = [str(obj.get(k, '')).lower().rstrip('.') for k in ['ldhName', 'unicodeName']]
+  if domain.lower().rstrip('.') in names:
+    return TEST_PASS, 'rdap'
+  return TEST_FAIL, None
+
+
+# Returns verdict as written to the debug store, PASS is followed by its indicator, e.g. PASS_domain_name
+def dbgVerdict(res, ind):
+  if res == TEST_PASS:
+    return "PASS_" + ind.replace(' ', '_').strip(':')
+  elif res == TEST_NOMATCH:
+    return "NOMA"
+  return "FAIL"
+
+
+# Returns Classifier built from JSON profile file
+def load(fname):
+  with open(fname, 'r') as f:
+    return Classifier(json.load(f))
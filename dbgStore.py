@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Content-addressed store of whois responses for debugging
+#
+# A store is three files sharing a base name
+#  BASE.idx = one line per query, ts server domain case rep verdict hash stopped, tab separated
+#  BASE.bod = one line per unique body, hash block_offset start length, tab separated
+#  BASE.blk = zlib compressed blocks, each prefixed by its 4 byte compressed length
+#
+# Identical bodies are stored once, hash is '-' for queries without a body
+# stopped is 1 if the body was cut short once its verdict was certain, else 0, older stores lack it
+# Bodies are buffered until BLOCK_SIZE bytes or FLUSH_INTERVAL seconds, then compressed together
+# The block pending is also written on close(), so a store stopped by a signal keeps its last bodies
+
+import os
+import sys
+import zlib
+import time
+import struct
+import hashlib
+import argparse
+
+BLOCK_SIZE = 262144 # Uncompressed bytes per compressed block
+FLUSH_INTERVAL = 60 # Seconds a body waits in a block before the block is written anyway
+NO_BODY = '-'
+IDX_SUFFIX = '.idx'
+BOD_SUFFIX = '.bod'
+BLK_SUFFIX = '.blk'
+
+
+# Returns hex content hash of body string
+def bodyHash(body):
+  return hashlib.blake2b(body.encode('utf-8', 'surrogateescape'), digest_size=16).hexdigest()
+
+
+# Returns base name of store when given any of its files
+def baseName(fname):
+  for suf in [IDX_SUFFIX, BOD_SUFFIX, BLK_SUFFIX]:
+    if fname.endswith(suf):
+      return fname[:-len(suf)]
+  return fname
+
+
+# Writes a debug store
+# mode = 'w' to start a new store, replacing any of the same name, or 'a' to append to it
+class DbgStore():
+  def __init__(self, base, blockSize=BLOCK_SIZE, flushInterval=FLUSH_INTERVAL, mode='w'):
+    self.blockSize = blockSize
+    self.flushInterval = flushInterval
+    self.idx = open(base + IDX_SUFFIX, mode)
+    self.bod = open(base + BOD_SUFFIX, mode)
+    self.blk = open(base + BLK_SUFFIX, mode + 'b')
+    self.known = set() # Hashes of bodies already stored or buffered
+    self.block = [] # Buffered (hash, encoded body)
+    self.blockLen = 0
+    self.blockStart = None # Monotonic time the first buffered body was added
+
+    # Appending to an existing store, don't store its bodies again
+    if os.path.getsize(base + BOD_SUFFIX) > 0:
+      with open(base + BOD_SUFFIX, 'r') as f:
+        for line in f:
+          self.known.add(line.split('\t', 1)[0])
+
+
+  # Record one query, body may be None
+  # stopped = True if body is only the part read until its verdict was certain
+  def add(self, server, domain, case, rep, verdict, body, ts=None, stopped=False):
+    if ts is None:
+      ts = time.time()
+
+    if body is None:
+      h = NO_BODY
+    else:
+      h = bodyHash(body)
+      if h not in self.known:
+        self.known.add(h)
+        raw = body.encode('utf-8', 'surrogateescape')
+        if not self.block:
+          self.blockStart = time.monotonic()
+        self.block.append((h, raw))
+        self.blockLen += len(raw)
+        if self.blockLen >= self.blockSize:
+          self.flushBlock()
+        else:
+          self.flushDue()
+
+    self.idx.write('%.6f' % ts + '\t' + server + '\t' + domain + '\t' + case + '\t' + str(rep) + '\t' + verdict + '\t' + h +
+                     '\t' + ('1' if stopped else '0') + '\n')
+
+
+  # Write the pending block if its first body has waited flushInterval seconds
+  # Also called on a timer by the writer so bodies reach disk when no more queries come
+  def flushDue(self):
+    if self.block and time.monotonic() - self.blockStart >= self.flushInterval:
+      self.flushBlock()
+
+
+  # Compress buffered bodies into one block
+  def flushBlock(self):
+    if not self.block:
+      return
+
+    off = self.blk.tell()
+    comp = zlib.compress(b''.join(raw for h, raw in self.block))
+    self.blk.write(struct.pack('<I', len(comp)) + comp)
+    self.blk.flush()
+
+    start = 0
+    for h, raw in self.block:
+      self.bod.write(h + '\t' + str(off) + '\t' + str(start) + '\t' + str(len(raw)) + '\n')
+      start += len(raw)
+    self.bod.flush()
+    self.idx.flush()
+    self.block = []
+    self.blockLen = 0
+    self.blockStart = None
+
+
+  def close(self):
+    self.flushBlock()
+    self.idx.close()
+    self.bod.close()
+    self.blk.close()
+
+
+# Reads a debug store
+class DbgReader():
+  def __init__(self, base):
+    self.base = base
+    self.locs = {}
+    with open(base + BOD_SUFFIX, 'r') as f:
+      for line in f:
+        h, off, start, length = line.rstrip('\n').split('\t')
+        self.locs[h] = (int(off), int(start), int(length))
+    self.blk = open(base + BLK_SUFFIX, 'rb')
+    self.cacheOff = None
+    self.cache = None
+
+
+  # Yields index records as (ts, server, domain, case, rep, verdict, hash, stopped)
+  # start and stop = byte range of the index to read, must be on line boundaries
+  def records(self, start=0, stop=None):
+    with open(self.base + IDX_SUFFIX, 'rb') as f:
+      f.seek(start)
+      for line in f:
+        if stop is not None and start >= stop:
+          break
+        start += len(line)
+        toks = line.decode('utf-8', 'surrogateescape').rstrip('\n').split('\t')
+        if len(toks) in (7, 8):
+          yield float(toks[0]), toks[1], toks[2], toks[3], int(toks[4]), toks[5], toks[6], toks[7:] == ['1']
+
+
+  # Returns body string for hash, None for NO_BODY or bodies lost in an unflushed block
+  def body(self, h):
+    if h not in self.locs:
+      return None
+
+    off, start, length = self.locs[h]
+    if off != self.cacheOff:
+      self.blk.seek(off)
+      size = struct.unpack('<I', self.blk.read(4))[0]
+      self.cache = zlib.decompress(self.blk.read(size))
+      self.cacheOff = off
+    return self.cache[start:start + length].decode('utf-8', 'surrogateescape')
+
+
+  # Returns list of (record, body) for matching queries, None matches everything
+  def find(self, server=None, domain=None, case=None, rep=None):
+    rv = []
+    for rec in self.records():
+      if server and rec[1] != server:
+        continue
+      if domain and rec[2] != domain:
+        continue
+      if case and rec[3] != case:
+        continue
+      if rep is not None and rec[4] != rep:
+        continue
+      rv.append((rec, self.body(rec[6])))
+    return rv
+
+
+  def close(self):
+    self.blk.close()
+
+
+# Write store in the old plain text dbg_ format
+def export(base, out):
+  rd = DbgReader(base)
+  for rec in rd.records():
+    body = rd.body(rec[6])
+    out.write("\n\n>whois -h " + rec[1] + " " + rec[2] + " " + rec[5])
+    if body is not None:
+      out.write("\n" + body)
+  rd.close()
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Read debug response stores written by wrl.py')
+  ap.add_argument('cmd', choices=['export', 'show', 'stats'],
+                    help='export = old dbg_ text format, show = responses of matching queries, stats = store sizes')
+  ap.add_argument('store', type=str, help='Store base name or any of its files')
+  ap.add_argument('-s', '--server', dest='server', type=str, default=None, help='Whois server')
+  ap.add_argument('-d', '--domain', dest='domain', type=str, default=None, help='Domain')
+  ap.add_argument('-c', '--case', dest='case', type=str, default=None, help='Test case, e.g. case-3 or case-3.17')
+  args = ap.parse_args()
+
+  base = baseName(args.store)
+  if args.cmd == 'export':
+    export(base, sys.stdout)
+
+  elif args.cmd == 'show':
+    case, rep = args.case, None
+    if case and '.' in case:
+      case, rep = case.split('.')[0], int(case.split('.')[1])
+    rd = DbgReader(base)
+    for rec, body in rd.find(args.server, args.domain, case, rep):
+      print('%.6f' % rec[0] + " " + rec[5] + " " + rec[1] + " " + rec[2] + " " + rec[3] + "." + str(rec[4]))
+      if body is not None:
+        print(body)
+    rd.close()
+
+  elif args.cmd == 'stats':
+    rd = DbgReader(base)
+    queries = sum(1 for rec in rd.records())
+    raw = sum(loc[2] for loc in rd.locs.values())
+    print("queries:" + str(queries) + " unique_bodies:" + str(len(rd.locs)) + " body_bytes:" + str(raw) +
+            " stored_bytes:" + str(os.path.getsize(base + BLK_SUFFIX)))
+    rd.close()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# DNS cache for whois servers
+# Resolves CNAME, A and AAAA for every server up front and keeps them fresh in the background
+# so queries connect to cached addresses and DNS stays out of the measured path
+# Servers may carry a :port suffix, it is ignored for lookups and kept on returned names
+# Queries take turns on the addresses of a server and fall back to the next one if connecting fails,
+# addresses that failed to connect go last for as long as lookups return the same addresses
+
+import sys
+import time
+import asyncio
+import ipaddress
+import concurrent.futures
+import dns.resolver
+
+MIN_TTL = 60 # Seconds, also how long failed lookups are cached
+MAX_TTL = 3600
+REFRESH_CHECK = 30 # Seconds between checks for expiring entries
+REFRESH_AHEAD = 60 # Refresh entries this many seconds before they expire
+WORKERS = 32 # Concurrent lookups
+
+
+# Cached answers for one server name
+class Entry():
+  def __init__(self, cname, addrs, ttl):
+    self.cname = cname
+    self.addrs = addrs
+    self.bad = set() # Addresses that failed to connect
+    self.next = 0 # Turn of addrs()
+    self.expires = time.monotonic() + min(max(ttl, MIN_TTL), MAX_TTL)
+
+
+class DnsCache():
+  def __init__(self, workers=WORKERS):
+    self.entries = {}
+    self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+
+  # Blocking lookup of one host, returns Entry
+  # Keeps previous addresses if the new lookup fails
+  def lookup(self, host):
+    try:
+      ipaddress.ip_address(host)
+      return Entry(host, [host], MAX_TTL)
+    except ValueError:
+      pass
+
+    d = dns.resolver.Resolver()
+    ttls = []
+    cname = host
+    try:
+      resp = d.query(host, 'CNAME')
+      if len(resp.rrset) > 0:
+        cname = str(resp.rrset[0]).strip('.')
+        ttls.append(resp.rrset.ttl)
+    except Exception:
+      pass
+
+    addrs = []
+    for rdtype in ['A', 'AAAA']:
+      try:
+        resp = d.query(cname, rdtype)
+        addrs.extend(str(rr) for rr in resp.rrset)
+        ttls.append(resp.rrset.ttl)
+      except Exception:
+        pass
+
+    if not addrs and host in self.entries:
+      old = self.entries[host]
+      return Entry(old.cname, old.addrs, MIN_TTL)
+    return Entry(cname, addrs, min(ttls) if ttls else MIN_TTL)
+
+
+  # Resolve all servers concurrently
+  async def resolveAll(self, servers):
+    loop = asyncio.get_running_loop()
+    hosts = list(set(s.partition(':')[0] for s in servers))
+    entries = await asyncio.gather(*[loop.run_in_executor(self.pool, self.lookup, h) for h in hosts])
+    for host, entry in zip(hosts, entries):
+      self.store(host, entry)
+
+
+  # Cache entry under host and its canonical name
+  # Failed addresses are kept while the addresses are unchanged
+  def store(self, host, entry):
+    old = self.entries.get(host)
+    if old and sorted(old.addrs) == sorted(entry.addrs):
+      entry.bad = old.bad
+      entry.next = old.next
+    self.entries[host] = entry
+    self.entries[entry.cname] = entry
+
+
+  # Background task re-resolving entries before they expire
+  async def refresh(self):
+    while True:
+      await asyncio.sleep(REFRESH_CHECK)
+      soon = time.monotonic() + REFRESH_AHEAD
+      stale = [h for h, e in self.entries.items() if e.expires < soon]
+      if stale:
+        await self.resolveAll(stale)
+
+
+  # Returns cached Entry for server, resolving it now if never seen
+  def entry(self, server):
+    host = server.partition(':')[0]
+    if host not in self.entries:
+      self.store(host, self.lookup(host))
+    return self.entries[host]
+
+
+  # Returns canonical name of server
+  def canonical(self, server):
+    host, sep, port = server.partition(':')
+    return self.entry(host).cname + sep + port
+
+
+  # Returns addresses to try in order for server, the host name itself if it did not resolve
+  # The first address takes turns, addresses that failed to connect go last
+  def addrs(self, server):
+    e = self.entry(server)
+    if not e.addrs:
+      return [server.partition(':')[0]]
+    e.next += 1
+    n = e.next % len(e.addrs)
+    order = e.addrs[n:] + e.addrs[:n]
+    return [a for a in order if a not in e.bad] + [a for a in order if a in e.bad]
+
+
+  # Put address addr of server last in addrs(), e.g. after it refused a connection
+  def failed(self, server, addr):
+    e = self.entry(server)
+    if addr in e.addrs:
+      e.bad.add(addr)
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    print("dnsCache.py SERVER [SERVER ...]")
+    exit(0)
+
+  cache = DnsCache()
+  asyncio.run(cache.resolveAll(sys.argv[1:]))
+  for server in sys.argv[1:]:
+    e = cache.entry(server)
+    print(server + " cname:" + e.cname + " addrs:" + ','.join(e.addrs) +
+            " ttl:" + str(int(e.expires - time.monotonic())))
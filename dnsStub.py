@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Local stand-in DNS server for testing genDomainList.py without network
+# Answers NS queries for registered names, CNAME queries for whois server names and NXDOMAIN for the rest
+
+import random
+import asyncio
+import argparse
+import dns.message
+import dns.rrset
+import dns.rcode
+import dns.rdatatype
+
+
+# UDP DNS responder
+# registered = set of lowercase domain names with NS records
+# cnames = dict of lowercase name to CNAME target
+# delay = seconds to wait before answering
+# drop = fraction of queries silently dropped, for timeout testing
+class StubDns(asyncio.DatagramProtocol):
+  def __init__(self, registered, cnames=None, delay=0, drop=0):
+    self.registered = registered
+    self.cnames = cnames or {}
+    self.delay = delay
+    self.drop = drop
+    self.queries = 0
+
+  def connection_made(self, transport):
+    self.transport = transport
+
+  # Returns wire format response to query
+  def respond(self, query):
+    resp = dns.message.make_response(query)
+    q = query.question[0]
+    name = q.name.to_text().strip('.').lower()
+    if q.rdtype == dns.rdatatype.NS and name in self.registered:
+      resp.answer.append(dns.rrset.from_text(q.name, 300, 'IN', 'NS', 'ns1.' + name + '.'))
+    elif q.rdtype == dns.rdatatype.CNAME and name in self.cnames:
+      resp.answer.append(dns.rrset.from_text(q.name, 300, 'IN', 'CNAME', self.cnames[name] + '.'))
+    elif name not in self.registered and name not in self.cnames:
+      resp.set_rcode(dns.rcode.NXDOMAIN)
+    return resp.to_wire()
+
+  def datagram_received(self, data, addr):
+    self.queries += 1
+    if self.drop and random.random() < self.drop:
+      return
+    try:
+      query = dns.message.from_wire(data)
+    except Exception:
+      return
+    if self.delay:
+      asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, self.respond(query), addr)
+    else:
+      self.transport.sendto(self.respond(query), addr)
+
+  # Returns transport listening on host:port, port 0 picks a free port
+  async def start(self, host='127.0.0.1', port=0):
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: self, local_addr=(host, port))
+    return transport
+
+
+async def serve(stub, host, port):
+  transport = await stub.start(host, port)
+  print("Listening on " + repr(transport.get_extra_info('sockname')))
+  await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Local stand-in DNS server')
+  ap.add_argument('-p', '--port', dest='port', type=int, default=5353, help='UDP port to listen on')
+  ap.add_argument('-b', '--bind', dest='host', type=str, default='127.0.0.1', help='Address to listen on')
+  ap.add_argument('-r', '--registered', dest='registered', type=str, required=True,
+                    help='File of registered domain names, one per line')
+  ap.add_argument('-c', '--cname', dest='cnames', type=str, action='append', default=[],
+                    help='NAME=TARGET CNAME record, may be repeated')
+  ap.add_argument('-d', '--delay', dest='delay', type=float, default=0, help='Seconds to wait before answering')
+  ap.add_argument('--drop', dest='drop', type=float, default=0, help='Fraction of queries to drop')
+  args = ap.parse_args()
+
+  with open(args.registered, 'r') as f:
+    registered = set(line.strip().lower() for line in f if len(line.strip()) > 0)
+  cnames = dict(c.lower().split('=', 1) for c in args.cnames)
+
+  try:
+    asyncio.run(serve(StubDns(registered, cnames, args.delay, args.drop), args.host, args.port))
+  except KeyboardInterrupt:
+    pass
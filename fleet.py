@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Coordinator and worker protocol for running wrl.py from many vantage hosts
+#
+# Workers connect to the coordinator over TCP, messages are JSON objects, one per line
+#  worker to coordinator
+#   {"type": "hello", "node": "host1", "slots": 256}
+#   {"type": "rec", "id": 3, "rec": {...}} result or event record, see resWriter.py, id is the subject of a result
+#   {"type": "case", "id": 3, "case": "case-2"} subject 3 finished a case
+#   {"type": "done", "id": 3} subject 3 finished all its cases
+#   {"type": "ping"}
+#  coordinator to worker
+#   {"type": "subject", "id": 3, "line": ["whois.nic.example", "foo.example"],
+#    "cases": [["case-0", 3600, 10], ...], "adaptive": false, "caseGap": 10, "limitWindow": 3600,
+#    "resume": {"case": 0, "rep": 4, "due": 1516000000.1, "domains": null}}
+#   {"type": "end"}
+#
+# Each worker runs at most slots subjects at once, subjects are handed to the worker with most free slots
+# A subject of a worker that disconnects or stays silent for DEAD_AFTER seconds goes back to the queue
+# and continues on another worker with the rep after the last result received of its first unfinished case,
+# due one case delay after that query was sent, like a journal resume in wrl.py. Queries of the lost worker
+# without a result are sent again. Every record received is tagged with the node that sent it
+
+import json
+import time
+import asyncio
+import collections
+import resWriter
+
+SLOTS = 256 # Subjects a worker runs at once
+HEARTBEAT = 10 # Seconds between worker pings
+DEAD_AFTER = 3 * HEARTBEAT
+LINE_LIMIT = 16 * 1048576 # Longest message in bytes
+
+
+# Queue msg on stream writer
+def send(writer, msg):
+  writer.write(json.dumps(msg, separators=(',', ':')).encode('utf-8') + b'\n')
+
+
+# Returns next message from stream reader, None on EOF
+async def recv(reader):
+  line = await reader.readline()
+  if not line:
+    return None
+  return json.loads(line)
+
+
+# Stands in for resWriter.ResWriter on a worker, records are sent to the coordinator
+# Called from the event loop only
+class RemoteWriter():
+  def __init__(self, writer):
+    self.writer = writer
+    self.ids = {} # Server as named in results to subject id, set by wrl.py
+
+
+  def result(self, verdict, server, domain, case, rep, latency, ip, connect=None, response=None, stopped=False):
+    msg = {'type': 'rec', 'rec': resWriter.resultRec(verdict, server, domain, case, rep,
+                                                     latency, ip, connect, response, stopped)}
+    if server in self.ids:
+      msg['id'] = self.ids[server]
+    send(self.writer, msg)
+
+
+  def event(self, name, server=None, case=None, value=None):
+    send(self.writer, {'type': 'rec', 'rec': resWriter.eventRec(name, server, case, value)})
+
+
+  # Bytes not yet sent
+  def depth(self):
+    return self.writer.transport.get_write_buffer_size()
+
+
+  def close(self):
+    self.writer.close()
+
+
+# One connected worker as seen by the coordinator
+class Worker():
+  def __init__(self, node, slots, writer):
+    self.node = node
+    self.slots = slots
+    self.writer = writer
+    self.assigned = set() # Subject ids
+    self.lastSeen = time.monotonic()
+
+
+class Coordinator():
+  # subjects = list of subject lines, cases = case schedule, rf = resWriter.ResWriter for all results
+  # minWorkers = workers to wait for before handing out the first subject so the first split is even
+  # limitWindow = seconds between adaptive probes, see wrl.py LIMIT_WINDOW
+  def __init__(self, subjects, cases, rf, adaptive=False, caseGap=0, minWorkers=1, limitWindow=0):
+    self.subjects = subjects
+    self.cases = dict((ii, list(cases)) for ii in range(len(subjects))) # Unfinished cases of each subject
+    self.resume = {} # Subject id to (next rep, wall clock due time) in its first unfinished case
+    self.rf = rf
+    self.adaptive = adaptive
+    self.caseGap = caseGap
+    self.limitWindow = limitWindow
+    self.minWorkers = minWorkers
+    self.started = False
+    self.pending = collections.deque(range(len(subjects)))
+    self.workers = set()
+    self.conns = set() # Tasks running handle()
+    self.done = set()
+    self.finished = asyncio.Event()
+
+
+  # Serve workers on host:port until every subject is done
+  async def serve(self, host, port):
+    srv = await asyncio.start_server(self.handle, host, port, limit=LINE_LIMIT)
+    reaper = asyncio.get_running_loop().create_task(self.reap())
+    if not self.subjects:
+      self.finished.set()
+    await self.finished.wait()
+
+    reaper.cancel()
+    for w in list(self.workers):
+      send(w.writer, {'type': 'end'})
+      await w.writer.drain()
+      w.writer.close()
+    srv.close()
+    if self.conns:
+      await asyncio.wait(self.conns, timeout=HEARTBEAT)
+
+
+  async def handle(self, reader, writer):
+    task = asyncio.current_task()
+    self.conns.add(task)
+    w = None
+    try:
+      hello = await recv(reader)
+      if not hello or hello.get('type') != 'hello':
+        return
+      w = Worker(hello['node'], hello['slots'], writer)
+      self.workers.add(w)
+      print("worker joined:" + w.node + " workers:" + str(len(self.workers)))
+      self.dispatch()
+
+      while True:
+        msg = await recv(reader)
+        if msg is None:
+          break
+        w.lastSeen = time.monotonic()
+        if msg['type'] == 'rec':
+          msg['rec']['node'] = w.node
+          self.rf.record(msg['rec'])
+          if 'id' in msg:
+            self.progress(msg['id'], msg['rec'])
+        elif msg['type'] == 'case':
+          cases = self.cases[msg['id']]
+          if cases and cases[0][0] == msg['case']:
+            cases.pop(0)
+            self.resume.pop(msg['id'], None)
+        elif msg['type'] == 'done':
+          self.resume.pop(msg['id'], None)
+          w.assigned.discard(msg['id'])
+          self.done.add(msg['id'])
+          if len(self.done) == len(self.subjects):
+            self.finished.set()
+          self.dispatch()
+    except (OSError, ValueError, KeyError) as e:
+      print("worker error:" + (w.node if w else '-') + " " + repr(e))
+    finally:
+      if w:
+        self.lost(w)
+      writer.close()
+      self.conns.discard(task)
+
+
+  # Note result record rec of subject ii, a requeued subject resumes after its latest rep
+  def progress(self, ii, rec):
+    cases = self.cases[ii]
+    if not cases or cases[0][0] != rec.get('case') or 'rep' not in rec:
+      return
+    rep, due = self.resume.get(ii, (0, None))
+    if rec['rep'] + 1 > rep:
+      self.resume[ii] = (rec['rep'] + 1, rec['ts'] - rec['latency'] + cases[0][1])
+
+
+  # Requeue subjects of a worker that left, they go first
+  def lost(self, w):
+    if w not in self.workers:
+      return
+    self.workers.discard(w)
+    for ii in sorted(w.assigned - self.done, reverse=True):
+      self.pending.appendleft(ii)
+    if not self.finished.is_set():
+      print("worker lost:" + w.node + " requeued:" + str(len(w.assigned - self.done)) +
+              " workers:" + str(len(self.workers)))
+    w.assigned = set()
+    self.dispatch()
+
+
+  # Hand pending subjects to workers with free slots
+  def dispatch(self):
+    if not self.started:
+      if len(self.workers) < self.minWorkers:
+        return
+      self.started = True
+
+    while self.pending:
+      free = [w for w in self.workers if len(w.assigned) < w.slots]
+      if not free:
+        return
+      w = max(free, key=lambda w: w.slots - len(w.assigned))
+      ii = self.pending.popleft()
+      w.assigned.add(ii)
+      msg = {'type': 'subject', 'id': ii, 'line': self.subjects[ii], 'cases': self.cases[ii],
+               'adaptive': self.adaptive, 'caseGap': self.caseGap, 'limitWindow': self.limitWindow}
+      if ii in self.resume and not self.adaptive:
+        rep, due = self.resume[ii]
+        msg['resume'] = {'case': 0, 'rep': rep, 'due': due, 'domains': None}
+      send(w.writer, msg)
+
+
+  # Drop workers that stopped pinging, their handle() then requeues their subjects
+  async def reap(self):
+    while True:
+      await asyncio.sleep(HEARTBEAT)
+      for w in list(self.workers):
+        if time.monotonic() - w.lastSeen > DEAD_AFTER:
+          print("worker silent:" + w.node)
+          w.writer.transport.abort()
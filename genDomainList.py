@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 #  The file is part of the WRL Project.
 #
@@ -18,78 +18,163 @@
 #  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
 
 import os
+import re
 import sys
+import mmap
 import random
 import argparse
+import asyncio
 import signal
-import dns.resolver
+import dns.asyncresolver
 
 ap = argparse.ArgumentParser(description='Find second level domains based on dictionary words')
 ap.add_argument('-w', '--words', dest='words', type=str, default='/usr/share/dict/words',
                   required=False, help='Dictionary File')
 ap.add_argument('-d', '--domains', dest='numDomains', type=int,
-                  required=True, help='Number of domains to find')
-ap.add_argument('-t', '--tld', dest='tld', type=str,
-                  required=True, help='TLD to search under')
+                  required=True, help='Number of domains to find per TLD')
+ap.add_argument('-t', '--tld', dest='tlds', type=str, action='append',
+                  required=True, help='TLD to search under, may be repeated')
+ap.add_argument('-c', '--concurrency', dest='concurrency', type=int, default=64,
+                  required=False, help='Maximum DNS queries in flight')
+ap.add_argument('-T', '--timeout', dest='timeout', type=float, default=3.0,
+                  required=False, help='Seconds to wait for each DNS query')
+ap.add_argument('-n', '--nameserver', dest='nameserver', type=str, default=None,
+                  required=False, help='Query this nameserver instead of the system resolvers')
+ap.add_argument('-p', '--port', dest='port', type=int, default=53,
+                  required=False, help='Nameserver port')
+ap.add_argument('--min-len', dest='minLen', type=int, default=1,
+                  required=False, help='Shortest word to try')
+ap.add_argument('--max-len', dest='maxLen', type=int, default=63,
+                  required=False, help='Longest word to try')
+ap.add_argument('--chars', dest='chars', type=str, default='a-z0-9-',
+                  required=False, help='Regex character class of allowed characters in lowercased words')
 ap.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
                   required=False, help='Verbose')
 
 args = ap.parse_args()
 
-DYING = False
 serverZone = '.ws.sp.am' # DNS Zone containing CNAME records pointing to whois FQDNs
-d = dns.resolver.Resolver()
+MAX_MISSES = 1000 # Duplicate or filtered samples in a row before switching to a sequential scan
+if args.nameserver:
+  d = dns.asyncresolver.Resolver(configure=False)
+  d.nameservers = [args.nameserver]
+  d.port = args.port
+else:
+  d = dns.asyncresolver.Resolver()
 
-# Die gracefully
-def euthanize(signal, frame):
-  global DYING
-  DYING = True
-
-signal.signal(signal.SIGINT, euthanize)
-signal.signal(signal.SIGTERM, euthanize)
-signal.signal(signal.SIGABRT, euthanize)
-signal.signal(signal.SIGALRM, euthanize)
-signal.signal(signal.SIGSEGV, euthanize)
-signal.signal(signal.SIGHUP, euthanize)
 
 # Get WHOIS server for TLD
-try:
-  resp = d.query(args.tld + serverZone, 'CNAME')
-  if len(resp.rrset) < 1:
-    whois = 'UNKNOWN'
-  else:
-    whois = str(resp.rrset[0]).strip('.')
-except:
-  whois = 'UNKNOWN'
-
-# Get random words
-random.seed()
-wf = open(args.words, 'r')
-ll = wf.read().splitlines()
-random.shuffle(ll)
-wf.close()
-
-# Look for words in DNS
-found = []
-for word in ll:
-  if DYING:
-    break
-  if len(found) == args.numDomains:
-    break
-
+async def whoisServer(tld):
   try:
-    resp = d.query(word.strip() + '.' + args.tld, 'NS')
-    if len(resp.rrset) >= 1:
-      found.append(word.lower())
-      if args.verbose:
-        print word
-  except:
-    pass
-
-# Print it
-rv = whois + ','
-for out in found:
-  rv += out + '.' + args.tld + ','
-
-print rv.strip(',')
+    resp = await d.resolve(tld + serverZone, 'CNAME', lifetime=args.timeout)
+    if len(resp.rrset) < 1:
+      return 'UNKNOWN'
+    else:
+      return str(resp.rrset[0]).strip('.')
+  except Exception: # Not BaseException, a signal must still cancel the lookup
+    return 'UNKNOWN'
+
+
+# Yields unique, lowercased, filtered words from the dictionary in random order
+# The file is memory mapped, never read into a list
+# A random byte offset picks the line after the one it lands in, and the pick is kept with
+# probability 1/length of the landed on line, so every line is equally likely
+# After MAX_MISSES duplicates or filtered words in a row the rest of the file is scanned from a random line
+def candidates(fname):
+  valid = re.compile('^[' + args.chars + ']{' + str(args.minLen) + ',' + str(args.maxLen) + '}$')
+  with open(fname, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+      return
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    seen = set()
+    misses = 0
+    while misses < MAX_MISSES:
+      off = random.randrange(size)
+      start = mm.rfind(b'\n', 0, off) + 1
+      end = mm.find(b'\n', off)
+      end = size if end == -1 else end + 1
+      if random.random() * (end - start) >= 1:
+        continue
+
+      if end == size:
+        end = 0
+      nxt = mm.find(b'\n', end)
+      word = mm[end:size if nxt == -1 else nxt].decode('utf-8', 'replace').strip().lower()
+      if word in seen or not valid.match(word):
+        misses += 1
+        continue
+      misses = 0
+      seen.add(word)
+      yield word
+
+    # Sequential scan, wrapping around to the random starting line
+    first = mm.rfind(b'\n', 0, random.randrange(size)) + 1
+    for start, stop in [(first, size), (0, first)]:
+      mm.seek(start)
+      while mm.tell() < stop:
+        word = mm.readline().decode('utf-8', 'replace').strip().lower()
+        if word not in seen and valid.match(word):
+          yield word
+    mm.close()
+
+
+# Look for words in DNS under tld
+# Runs args.concurrency workers sharing the candidate words and the global query limit
+# Returns once numDomains are found, the words run out or dying is set, with the words found so far
+async def probe(tld, limit, dying):
+  found = []
+  done = asyncio.Event()
+  words = candidates(args.words)
+
+  async def worker():
+    for word in words:
+      if done.is_set() or dying.is_set():
+        return
+
+      try:
+        async with limit:
+          resp = await d.resolve(word + '.' + tld, 'NS', lifetime=args.timeout, raise_on_no_answer=False)
+      except Exception: # Lookup failures only, cancellation ends the worker
+        continue
+
+      if resp.rrset is not None and len(resp.rrset) >= 1 and len(found) < args.numDomains:
+        found.append(word)
+        if args.verbose:
+          print(word + '.' + tld, file=sys.stderr)
+        if len(found) == args.numDomains:
+          done.set()
+
+  workers = [asyncio.ensure_future(worker()) for ii in range(args.concurrency)]
+  waits = [asyncio.ensure_future(asyncio.gather(*workers)), asyncio.ensure_future(done.wait()),
+             asyncio.ensure_future(dying.wait())]
+  await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+  for t in workers + waits:
+    t.cancel()
+  await asyncio.gather(*workers, *waits, return_exceptions=True)
+  return found
+
+
+async def main():
+  # Die gracefully, printing what was found so far
+  dying = asyncio.Event()
+  loop = asyncio.get_running_loop()
+  for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGABRT, signal.SIGALRM, signal.SIGSEGV, signal.SIGHUP]:
+    loop.add_signal_handler(sig, dying.set)
+
+  limit = asyncio.Semaphore(args.concurrency)
+  servers = await asyncio.gather(*[whoisServer(tld) for tld in args.tlds])
+  results = await asyncio.gather(*[probe(tld, limit, dying) for tld in args.tlds])
+
+  # Print it
+  for tld, whois, found in zip(args.tlds, servers, results):
+    rv = whois + ','
+    for out in found:
+      rv += out + '.' + tld + ','
+    print(rv.strip(','))
+
+
+random.seed()
+asyncio.run(main())
 sys.exit(0)
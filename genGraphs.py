@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 #  The file is part of the WRL Project.
 #
@@ -17,89 +17,197 @@
 #
 #  Copyright (C) 2017, Andrew McConachie, <andrew.mcconachie@icann.org>
 
+import os
 import sys
+import math
 import datetime
 import argparse
+import concurrent.futures
+import numpy as np
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as plt
+import matplotlib.lines
+import matplotlib.collections
 
 
 # Order of tuples in CSV input
-PASS = 1
-FAIL = 2
-NOMA = 3
-
-
-# Takes CSV data and an offset
-# Returns percentages as a list of floats
-def calcPercs(data, offset, numCases):
-  rv = {}
-  for line in data:
-    rv[line[0]] = []
-    for ii in xrange(numCases):
-      rv[line[0]].append(100 * (float(line[ii * 3 + offset]) / (int(line[ii * 3 + 1]) + int(line[ii * 3 + 2]) + int(line[ii * 3 + 3]))))
-  return rv
-
-
-ap = argparse.ArgumentParser(description='Generate graphs from CSV files.')
-ap.add_argument('-q', '--qh', action='store_true', dest='qh', help='Use appended queries/hour')
-ap.add_argument('-d', '--debug', action='store_true', dest='dbg', help='Print results to stdout instead of graphing')
-ap.add_argument('-l', '--legend', action='store_true', default=False, dest='legend', help='Include legend in outputted graphs')
-ap.add_argument('-p', '--prefix', nargs=1, metavar='prefix', dest='prefix',
-                  type=str, default=None, required=False, help='Output filename prefix')
-ap.add_argument('-f', '--file', nargs=1, metavar='file', dest='infile',
-                  type=argparse.FileType('r'), default=sys.stdin, required=False, help='CSV input file if not using stdin')
-ap.add_argument('graph', choices=['pass', 'fail', 'noma'], help='Values to graph')
-args = ap.parse_args()
-
-if args.prefix == None:
-  outFilePref = ''
-else:
-  outFilePref = args.prefix[0].strip('_').strip()
-  
-data = []
-for line in args.infile.read().split('\n'):
-  if len(line) > 0:
-    if line.split(',')[0] == 'server': # Don't append header line
+PASS = 0
+FAIL = 1
+NOMA = 2
+GRAPHS = {'pass': PASS, 'fail': FAIL, 'noma': NOMA}
+
+NUM_CASES = 9 # Used when the CSV has no header
+XTICKS = [1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0, 240.0] # Hardcoded Queries per-hour
+PANEL_SIZE = 3 # Inches per small multiple panel
+QH_COL = '{}-q/h' # Header name of the queries/hour column for each case, written by prepResults.py -q
+
+
+# Reads prepResults.py CSV from f
+# Returns (names, counts, qh), counts is an int array of servers x cases x [pass, fail, noma]
+# qh is the float array of the N-q/h columns found by header name, None if the header has none
+def loadCsv(f):
+  names = []
+  rows = []
+  header = None
+  for line in f.read().split('\n'):
+    toks = line.strip().split(',')
+    if len(toks) < 2:
       continue
-    data.append(line.strip('\n').split(','))
-args.infile.closed
-
-if args.qh:
-  xTicks = map(float, data[0][-9:])
-else:
-  xTicks = [1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0, 240.0] # Hardcoded Queries per-hour
-
-percs = {}
-percs['pass'] = calcPercs(data, PASS, len(xTicks))
-percs['fail'] = calcPercs(data, FAIL, len(xTicks))
-percs['noma'] = calcPercs(data, NOMA, len(xTicks))
-
-if args.dbg:
-  print("xTicks:" + repr(xTicks))
-  for res in percs[args.graph].iteritems():
-    print(repr(res))
-  exit(0)
-
-legend = []
-fig, ax = plt.subplots()
-ax.set_xscale('log')
-ax.set_xticks(xTicks)
-ax.get_xaxis().set_major_formatter(matplotlib.ticker.ScalarFormatter())
-ax.set_xlabel("Queries / Hour (logN)")
-ax.set_ylabel("% " + args.graph)
-
-for k,v in percs[args.graph].iteritems():
-  if sum(v) > 0:
-    if min(v) != 100:
-      ax.plot(xTicks, v)
-      legend.append(k)
-    else:
-      print("100% " + args.graph + ":" + k)
-
-if args.legend:
-  ax.legend(legend, loc=2, bbox_to_anchor=(1, 1))
-
-date = datetime.datetime.now().strftime("%Y_%m_%d")
-fig.savefig(outFilePref + '_' + args.graph + '_' + date + '.png', pad_inches=0.1, bbox_inches='tight')
+    if not toks[1].isdigit(): # Header line
+      header = toks[1:]
+      continue
+    names.append(toks[0])
+    rows.append(toks[1:])
+
+  if header is None:
+    numCases = NUM_CASES
+  else:
+    numCases = sum(1 for t in header if t.endswith('-pass'))
+  if not rows:
+    return names, np.zeros((0, numCases, 3), dtype=np.int64), None
+
+  data = np.array(rows, dtype=float)
+  counts = data[:, :numCases * 3].astype(np.int64).reshape(len(rows), numCases, 3)
+  qh = None
+  if header is not None:
+    cols = [header.index(QH_COL.format(ii)) for ii in range(numCases) if QH_COL.format(ii) in header]
+    if cols:
+      qh = data[:, cols]
+  return names, counts, qh
+
+
+# Returns percentages of all results as a float array of servers x [pass, fail, noma] x cases
+# Cases that were not run are 0
+def calcPercs(counts):
+  totals = counts.sum(axis=2, keepdims=True)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    percs = np.where(totals > 0, 100 * (counts / totals), 0.0)
+  return percs.transpose(0, 2, 1)
+
+
+# Returns mask of rows worth plotting, rows that are all 0 or all 100 are left out
+def plotted(v):
+  return (v.sum(axis=1) > 0) & (v.min(axis=1) != 100)
+
+
+# Draws rows of v against xTicks on ax as one LineCollection
+# Returns the line colours
+def drawLines(ax, xTicks, v):
+  ax.set_xscale('log')
+  ax.set_xticks(xTicks)
+  ax.get_xaxis().set_major_formatter(matplotlib.ticker.ScalarFormatter())
+  ax.get_xaxis().set_minor_locator(matplotlib.ticker.NullLocator()) # Log minor ticks dominate render time
+  ax.set_xlim(min(xTicks), max(xTicks))
+  ax.set_ylim(-2, 102)
+  cycle = plt.rcParams['axes.prop_cycle'].by_key()['color']
+  colors = [cycle[ii % len(cycle)] for ii in range(len(v))]
+  segs = np.stack([np.broadcast_to(xTicks, v.shape), v], axis=-1)
+  ax.add_collection(matplotlib.collections.LineCollection(segs, colors=colors))
+  return colors
+
+
+# Renders one figure, run in a worker process
+# task = (fname, graph, xTicks, panels, legend), panels is a list of (title, names, values)
+def render(task):
+  fname, graph, xTicks, panels, legend = task
+  if len(panels) == 1:
+    fig, ax = plt.subplots()
+    axes = [ax]
+  else:
+    cols = math.ceil(math.sqrt(len(panels)))
+    rows = math.ceil(len(panels) / cols)
+    fig, axes = plt.subplots(rows, cols, figsize=(cols * PANEL_SIZE, rows * PANEL_SIZE),
+                               sharex=True, sharey=True, squeeze=False)
+    axes = axes.flatten()
+    for ax in axes[len(panels):]:
+      ax.set_visible(False)
+
+  for ax, (title, names, v) in zip(axes, panels):
+    colors = drawLines(ax, xTicks, v)
+    if title:
+      ax.set_title(title, fontsize='small')
+    if legend:
+      handles = [matplotlib.lines.Line2D([], [], color=c) for c in colors]
+      if title: # Inside the panel so it does not cover the next one
+        ax.legend(handles, names, loc='best', fontsize='x-small')
+      else:
+        ax.legend(handles, names, loc=2, bbox_to_anchor=(1, 1))
+
+  if len(panels) == 1:
+    axes[0].set_xlabel("Queries / Hour (logN)")
+    axes[0].set_ylabel("% " + graph)
+  else:
+    fig.supxlabel("Queries / Hour (logN)")
+    fig.supylabel("% " + graph)
+  fig.savefig(fname, pad_inches=0.1, bbox_inches='tight')
+  plt.close(fig)
+  return fname
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Generate graphs from CSV files.')
+  ap.add_argument('-q', '--qh', action='store_true', dest='qh', help='Use appended queries/hour')
+  ap.add_argument('-d', '--debug', action='store_true', dest='dbg', help='Print results to stdout instead of graphing')
+  ap.add_argument('-l', '--legend', action='store_true', default=False, dest='legend', help='Include legend in outputted graphs')
+  ap.add_argument('-p', '--prefix', nargs=1, metavar='prefix', dest='prefix',
+                    type=str, default=None, required=False, help='Output filename prefix')
+  ap.add_argument('-f', '--file', metavar='file', dest='infile',
+                    type=argparse.FileType('r'), default=sys.stdin, required=False, help='CSV input file if not using stdin')
+  ap.add_argument('-j', '--jobs', dest='jobs', type=int, default=os.cpu_count(), help='Worker processes for rendering')
+  ap.add_argument('graph', choices=['pass', 'fail', 'noma', 'all'],
+                    help='Values to graph, all = pass, fail and noma plus per TLD small multiples of each')
+  args = ap.parse_args()
+
+  if args.prefix == None:
+    outFilePref = ''
+  else:
+    outFilePref = args.prefix[0].strip('_').strip()
+
+  names, counts, qh = loadCsv(args.infile)
+  args.infile.close()
+
+  if args.qh:
+    if qh is None:
+      ap.error('CSV header has no ' + QH_COL.format('N') + ' columns, rerun prepResults.py with -q')
+    xTicks = [float(x) for x in qh[0]]
+  else:
+    xTicks = XTICKS[:counts.shape[1]]
+  percs = calcPercs(counts)[:, :, :len(xTicks)]
+  names = np.array(names)
+
+  graphs = ['pass', 'fail', 'noma'] if args.graph == 'all' else [args.graph]
+  if args.dbg:
+    print("xTicks:" + repr(xTicks))
+    for graph in graphs:
+      for name, v in zip(names, percs[:, GRAPHS[graph]]):
+        print(repr((str(name), v.tolist())))
+    exit(0)
+
+  date = datetime.datetime.now().strftime("%Y_%m_%d")
+  tasks = []
+  for graph in graphs:
+    v = percs[:, GRAPHS[graph]]
+    for name in names[(v.sum(axis=1) > 0) & (v.min(axis=1) == 100)]:
+      print("100% " + graph + ":" + name)
+    keep = plotted(v)
+    tasks.append((outFilePref + '_' + graph + '_' + date + '.png', graph, xTicks,
+                    [(None, list(names[keep]), v[keep])], args.legend))
+
+    # Small multiples need tld_server rows from prepResults.py -bt
+    if args.graph == 'all' and all('_' in n for n in names):
+      tlds = np.array([n.split('_', 1)[0] for n in names])
+      panels = []
+      for tld in sorted(set(tlds[keep])):
+        sel = keep & (tlds == tld)
+        panels.append((tld, [n.split('_', 1)[1] for n in names[sel]], v[sel]))
+      if panels:
+        tasks.append((outFilePref + '_' + graph + '_tld_' + date + '.png', graph, xTicks, panels, args.legend))
+
+  if len(tasks) > 1:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+      for fname in pool.map(render, tasks):
+        print(fname)
+  else:
+    for task in tasks:
+      print(render(task))
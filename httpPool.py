@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Thread safe pool of keep-alive HTTP connections and an on-disk cache honouring ETag/Last-Modified
+
+import os
+import json
+import hashlib
+import threading
+import http.client
+import urllib.parse
+
+TIMEOUT = 10 # Seconds for connect and each read
+MAX_IDLE = 8 # Idle connections kept per host
+USER_AGENT = 'WRL'
+
+
+# Raised for responses other than 200 and 304
+class HttpError(Exception):
+  def __init__(self, url, status, headers, body):
+    self.url = url
+    self.status = status
+    self.headers = headers
+    self.body = body
+    Exception.__init__(self, str(status) + ' ' + url)
+
+
+class HttpPool():
+  def __init__(self, timeout=TIMEOUT, maxIdle=MAX_IDLE):
+    self.timeout = timeout
+    self.maxIdle = maxIdle
+    self.idle = {} # (scheme, host, port) to list of idle connections
+    self.lock = threading.Lock()
+
+
+  # Returns idle connection for key or a new one, and whether it was reused
+  def take(self, key):
+    with self.lock:
+      if self.idle.get(key):
+        return self.idle[key].pop(), True
+
+    scheme, host, port = key
+    if scheme == 'https':
+      return http.client.HTTPSConnection(host, port, timeout=self.timeout), False
+    return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+
+  # Return connection to the pool
+  def give(self, key, conn):
+    with self.lock:
+      conns = self.idle.setdefault(key, [])
+      if len(conns) < self.maxIdle:
+        conns.append(conn)
+        return
+    conn.close()
+
+
+  # Send request, returns (status, headers dict with lowercase names, body bytes)
+  # A reused connection the server has since closed is retried once on a new connection
+  # info = optional dict receiving 'peer', the address of the server the request went to
+  def request(self, method, url, headers=None, info=None):
+    u = urllib.parse.urlsplit(url)
+    key = (u.scheme, u.hostname, u.port or (443 if u.scheme == 'https' else 80))
+    path = u.path or '/'
+    if u.query:
+      path += '?' + u.query
+    hdrs = {'User-Agent': USER_AGENT, 'Connection': 'keep-alive'}
+    hdrs.update(headers or {})
+
+    while True:
+      conn, reused = self.take(key)
+      try:
+        conn.request(method, path, headers=hdrs)
+        if info is not None and conn.sock:
+          info['peer'] = conn.sock.getpeername()[0]
+        resp = conn.getresponse()
+        body = resp.read()
+      except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError):
+        conn.close()
+        if reused:
+          continue
+        raise
+      except Exception:
+        conn.close()
+        raise
+
+      if resp.will_close:
+        conn.close()
+      else:
+        self.give(key, conn)
+      return resp.status, dict((k.lower(), v) for k, v in resp.getheaders()), body
+
+
+  def close(self):
+    with self.lock:
+      for conns in self.idle.values():
+        for conn in conns:
+          conn.close()
+      self.idle = {}
+
+
+# On-disk cache of GET responses in front of an HttpPool
+# Cached pages are revalidated with If-None-Match/If-Modified-Since and reused on 304
+class HttpCache():
+  def __init__(self, pool, cacheDir):
+    self.pool = pool
+    self.cacheDir = cacheDir
+    os.makedirs(cacheDir, exist_ok=True)
+    self.hits = 0
+    self.misses = 0
+
+
+  def path(self, url):
+    return os.path.join(self.cacheDir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+
+  # Returns body bytes of url, raises HttpError
+  def get(self, url):
+    base = self.path(url)
+    meta = None
+    if os.path.exists(base + '.json') and os.path.exists(base + '.body'):
+      with open(base + '.json', 'r') as f:
+        meta = json.load(f)
+
+    headers = {}
+    if meta:
+      if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+      if meta.get('last-modified'):
+        headers['If-Modified-Since'] = meta['last-modified']
+
+    status, hdrs, body = self.pool.request('GET', url, headers)
+    if status == 304 and meta:
+      self.hits += 1
+      with open(base + '.body', 'rb') as f:
+        return f.read()
+    if status != 200:
+      raise HttpError(url, status, hdrs, body)
+
+    self.misses += 1
+    if hdrs.get('etag') or hdrs.get('last-modified'):
+      with open(base + '.body', 'wb') as f:
+        f.write(body)
+      with open(base + '.json', 'w') as f:
+        json.dump({'url': url, 'etag': hdrs.get('etag'), 'last-modified': hdrs.get('last-modified')}, f)
+    return body
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Local stand-in HTTP server for testing without network
+# Serves fixture pages from a directory over keep-alive HTTP/1.1 with ETag and Last-Modified
+# and answers conditional requests with 304
+# With --rdap it is an RDAP server instead, see RdapHandler
+
+import os
+import json
+import hashlib
+import argparse
+import threading
+import email.utils
+import http.server
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  root = '.'
+
+  def log_message(self, fmt, *args):
+    pass
+
+  # Send a complete response, body is bytes
+  def reply(self, status, body, ctype='text/html', headers=None):
+    self.send_response(status)
+    self.send_header('Content-Type', ctype)
+    self.send_header('Content-Length', str(len(body)))
+    for k, v in (headers or {}).items():
+      self.send_header(k, v)
+    self.end_headers()
+    if self.command != 'HEAD':
+      self.wfile.write(body)
+
+  def do_GET(self):
+    path = os.path.normpath(os.path.join(self.root, self.path.split('?')[0].lstrip('/')))
+    if not path.startswith(os.path.normpath(self.root)) or not os.path.isfile(path):
+      self.reply(404, b'Not Found', 'text/plain')
+      return
+
+    with open(path, 'rb') as f:
+      body = f.read()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    lastMod = email.utils.formatdate(os.path.getmtime(path), usegmt=True)
+    if self.headers.get('If-None-Match') == etag or \
+         (self.headers.get('If-None-Match') is None and self.headers.get('If-Modified-Since') == lastMod):
+      self.reply(304, b'', headers={'ETag': etag, 'Last-Modified': lastMod})
+      return
+    self.reply(200, body, headers={'ETag': etag, 'Last-Modified': lastMod})
+
+  do_HEAD = do_GET
+
+
+# Stand-in RDAP server answering GET .../domain/NAME
+# Domains in domains get a domain object, others a 404 error, None registers every domain
+# After limit queries, 0 for unlimited, every query gets a 429 error with a Retry-After of retryAfter seconds
+class RdapHandler(StubHandler):
+  domains = None
+  limit = 0
+  retryAfter = 60
+  queries = 0
+  lock = threading.Lock()
+
+  # Send an RDAP error object
+  def error(self, status, title, headers=None):
+    body = json.dumps({'errorCode': status, 'title': title}).encode('utf-8')
+    self.reply(status, body, 'application/rdap+json', headers)
+
+  def do_GET(self):
+    base, sep, name = self.path.split('?')[0].rpartition('/domain/')
+    if not sep or not name:
+      self.error(400, 'Bad Request')
+      return
+
+    with RdapHandler.lock:
+      RdapHandler.queries += 1
+      limited = self.limit and RdapHandler.queries > self.limit
+    if limited:
+      self.error(429, 'Too Many Requests', {'Retry-After': str(self.retryAfter)})
+      return
+
+    name = name.lower()
+    if self.domains is not None and name not in self.domains:
+      self.error(404, 'Not Found')
+      return
+    body = json.dumps({'objectClassName': 'domain', 'ldhName': name.upper(), 'handle': '1234567_DOMAIN_STUB',
+                       'status': ['active'], 'rdapConformance': ['rdap_level_0'],
+                       'events': [{'eventAction': 'registration', 'eventDate': '2001-01-15T00:00:00Z'}]})
+    self.reply(200, body.encode('utf-8'), 'application/rdap+json')
+
+  do_HEAD = do_GET
+
+
+# Returns running ThreadingHTTPServer for handler class, port 0 picks a free port
+def start(handler, host='127.0.0.1', port=0):
+  srv = http.server.ThreadingHTTPServer((host, port), handler)
+  srv.daemon_threads = True
+  threading.Thread(target=srv.serve_forever, daemon=True).start()
+  return srv
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Local stand-in HTTP server for fixture pages')
+  ap.add_argument('-p', '--port', dest='port', type=int, default=8080, help='TCP port to listen on')
+  ap.add_argument('-b', '--bind', dest='host', type=str, default='127.0.0.1', help='Address to listen on')
+  ap.add_argument('-d', '--dir', dest='root', type=str, default='.', help='Directory of fixture pages')
+  ap.add_argument('--rdap', dest='rdap', action='store_true', default=False, help='Serve RDAP domain lookups instead')
+  ap.add_argument('-f', '--file', dest='subjects', type=str, default=None,
+                    help='Subject CSV, only its domains are registered, RDAP only')
+  ap.add_argument('-l', '--limit', dest='limit', type=int, default=0, help='Queries answered before rate limiting, RDAP only')
+  ap.add_argument('-r', '--retry-after', dest='retryAfter', type=int, default=60,
+                    help='Retry-After seconds sent when rate limiting, RDAP only')
+  args = ap.parse_args()
+
+  handler = StubHandler
+  StubHandler.root = args.root
+  if args.rdap:
+    handler = RdapHandler
+    RdapHandler.limit = args.limit
+    RdapHandler.retryAfter = args.retryAfter
+    if args.subjects:
+      RdapHandler.domains = set()
+      with open(args.subjects, 'r') as f:
+        for line in f.read().split('\n'):
+          if len(line) > 0:
+            RdapHandler.domains.update(d.lower() for d in line.split(',')[1:])
+  srv = http.server.ThreadingHTTPServer((args.host, args.port), handler)
+  print("Listening on " + repr(srv.server_address))
+  try:
+    srv.serve_forever()
+  except KeyboardInterrupt:
+    pass
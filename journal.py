@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Progress journal of a wrl.py run, used by wrl.py --resume
+#
+# One JSON document replaced atomically every INTERVAL seconds and when the run exits
+#  {"fname": "host_subjects_2018_01_15.txt", "ts": 1516000000.1,
+#   "servers": {"whois.nic.example": {"case": 3, "rep": 17, "domains": ["foo.example", ...], "due": 1516000012.5},
+#               "whois.nic.other": {"done": true}}}
+# Servers are keyed by the name on their subject line
+#  case = index of the current case in TESTS, rep = next query to send
+#  domains = order of domains in the current case, null before the case starts
+#  due = wall clock time rep is due
+# Queries in flight when the run stopped are not sent again, if due has passed the case continues
+# at once and keeps its spacing from there
+# After a kill that skips euthanize() queries sent since the last periodic write are sent again
+#
+# The snapshot is taken on the event loop, it holds only references and numbers
+# Encoding and writing happen on a thread so queries are never held up by disk
+
+import os
+import sys
+import json
+import time
+import asyncio
+
+INTERVAL = 30 # Seconds between journal writes
+
+
+class Journal():
+  # snapshot = function returning the current servers dict
+  def __init__(self, fname, runName, snapshot, interval=INTERVAL):
+    self.fname = fname
+    self.runName = runName
+    self.snapshot = snapshot
+    self.interval = interval
+
+
+  # Write the journal now, blocking
+  def write(self, servers=None):
+    if servers is None:
+      servers = self.snapshot()
+    doc = json.dumps({'fname': self.runName, 'ts': time.time(), 'servers': servers})
+    with open(self.fname + '.tmp', 'w') as f:
+      f.write(doc)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(self.fname + '.tmp', self.fname)
+
+
+  # Background task writing the journal every interval seconds
+  async def run(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      await asyncio.sleep(self.interval)
+      await loop.run_in_executor(None, self.write, self.snapshot())
+
+
+# Returns journal dict from fname
+def load(fname):
+  with open(fname, 'r') as f:
+    return json.load(f)
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    print("journal.py JOURNAL")
+    exit(0)
+
+  jnl = load(sys.argv[1])
+  done = sum(1 for s in jnl['servers'].values() if s.get('done'))
+  print("fname:" + jnl['fname'] + " written:" + time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(jnl['ts'])) +
+          " servers:" + str(len(jnl['servers'])) + " done:" + str(done))
+  for server, s in sorted(jnl['servers'].items()):
+    if not s.get('done'):
+      print(server + " case:" + str(s['case']) + " rep:" + str(s['rep']) +
+              " due_in:" + str(round(s['due'] - time.time(), 1)))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Streaming log-bucketed latency histogram
+#
+# Bucket b > 0 holds values in (MIN_VALUE * GROWTH^(b-1), MIN_VALUE * GROWTH^b], bucket 0 everything up to MIN_VALUE
+# and the last bucket everything above MAX_VALUE, so a histogram never has more than MAX_BUCKET + 1 entries
+# Quantiles are interpolated on a log scale within their bucket by their rank among the bucket's values,
+# a bucket holding one value reports its geometric middle, always within GROWTH of the true value
+# Histograms of any number of queries merge exactly, so partial histograms can be built in parallel
+
+import math
+
+MIN_VALUE = 0.0001 # Seconds
+MAX_VALUE = 3600.0 # Seconds
+GROWTH = 1.04 # Relative width of each bucket
+LOG_GROWTH = math.log(GROWTH)
+MAX_BUCKET = int(math.ceil(math.log(MAX_VALUE / MIN_VALUE) / LOG_GROWTH))
+PERCENTILES = [50, 90, 99]
+
+
+# Returns bucket index of value in seconds
+def bucket(v):
+  if v <= MIN_VALUE:
+    return 0
+  return min(int(math.ceil(math.log(v / MIN_VALUE) / LOG_GROWTH)), MAX_BUCKET)
+
+
+# Returns value in seconds reported at fraction f through bucket b on a log scale, its geometric middle by default
+def value(b, f=0.5):
+  if b == 0:
+    return MIN_VALUE
+  return MIN_VALUE * GROWTH ** (b - 1 + f)
+
+
+class LatHist():
+  # counts = dict of bucket index to count, as returned by state()
+  def __init__(self, counts=None):
+    self.counts = {}
+    self.n = 0
+    for b, c in (counts or {}).items():
+      self.counts[int(b)] = c
+      self.n += c
+
+
+  def add(self, v):
+    b = bucket(v)
+    self.counts[b] = self.counts.get(b, 0) + 1
+    self.n += 1
+
+
+  def merge(self, other):
+    for b, c in other.counts.items():
+      self.counts[b] = self.counts.get(b, 0) + c
+    self.n += other.n
+
+
+  # Returns value at quantile q between 0 and 1, None if empty
+  def quantile(self, q):
+    if self.n == 0:
+      return None
+    rank = max(1, int(math.ceil(q * self.n)))
+    seen = 0
+    for b in sorted(self.counts):
+      c = self.counts[b]
+      seen += c
+      if seen >= rank:
+        return value(b, (rank - (seen - c) - 0.5) / c)
+
+
+  # Returns dict of 'pNN' to value for each of PERCENTILES plus the count 'n'
+  def percentiles(self, pcts=PERCENTILES):
+    rv = {'n': self.n}
+    for p in pcts:
+      q = self.quantile(p / 100.0)
+      rv['p' + str(p)] = None if q is None else round(q, 6)
+    return rv
+
+
+  # Returns JSON serialisable state, see __init__()
+  def state(self):
+    return dict((str(b), c) for b, c in self.counts.items())
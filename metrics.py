@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# In-memory counters of a running wrl.py and a small HTTP endpoint serving them
+#
+# The query path only increments counters, all totals are worked out when the endpoint is scraped
+#  GET /metrics = Prometheus text format
+#  GET /metrics.json = the same values as JSON
+#
+# Served values
+#  issued, in flight and completed queries per server and case, completed split by verdict
+#  timeouts by stage, see whoisClient.py
+#  scheduler lag = seconds between the due time of a query and when it was handed to a worker slot
+#  writer queue depth, active jobs and scheduler heap size from the gauges passed in
+
+import json
+import time
+import asyncio
+import latHist
+
+READ_TIMEOUT = 5 # Seconds to wait for a request
+LAG_QUANTILES = [0.5, 0.9, 0.99]
+
+
+class Metrics():
+  # gauges = dict of name to function returning a number, read on each scrape
+  def __init__(self, gauges=None):
+    self.gauges = gauges or {}
+    self.issued = {} # (server, case) to count
+    self.verdicts = {} # (server, case, verdict) to count
+    self.timeouts = {} # stage to count
+    self.lag = latHist.LatHist()
+    self.lagMax = 0.0
+    self.lagSum = 0.0
+    self.started = time.time()
+
+
+  # Count query handed to a worker slot lag seconds after it was due
+  def issue(self, server, case, lag):
+    key = (server, case)
+    self.issued[key] = self.issued.get(key, 0) + 1
+    lag = max(lag, 0.0)
+    self.lag.add(lag)
+    self.lagSum += lag
+    if lag > self.lagMax:
+      self.lagMax = lag
+
+
+  # Count completed query
+  def complete(self, server, case, verdict):
+    key = (server, case, verdict)
+    self.verdicts[key] = self.verdicts.get(key, 0) + 1
+
+
+  def timeout(self, stage):
+    self.timeouts[stage] = self.timeouts.get(stage, 0) + 1
+
+
+  # Returns all values as a dict
+  def values(self):
+    completed = {}
+    for (server, case, verdict), n in self.verdicts.items():
+      completed[(server, case)] = completed.get((server, case), 0) + n
+
+    queries = []
+    for (server, case), n in sorted(self.issued.items()):
+      done = completed.get((server, case), 0)
+      queries.append({'server': server, 'case': case, 'issued': n, 'completed': done, 'in_flight': n - done})
+    verdicts = [{'server': s, 'case': c, 'verdict': v, 'count': n} for (s, c, v), n in sorted(self.verdicts.items())]
+
+    quantiles = {}
+    for q in LAG_QUANTILES: # Bucket middles can overshoot the largest lag
+      val = self.lag.quantile(q)
+      quantiles[str(q)] = None if val is None else round(min(val, self.lagMax), 6)
+
+    rv = {'uptime': round(time.time() - self.started, 3), 'queries': queries, 'verdicts': verdicts,
+          'timeouts': dict(self.timeouts),
+          'lag': {'count': self.lag.n, 'sum': round(self.lagSum, 6), 'max': round(self.lagMax, 6),
+                   'quantiles': quantiles}}
+    for name, fn in self.gauges.items():
+      rv[name] = fn()
+    return rv
+
+
+  # Returns all values in Prometheus text format
+  def prometheus(self):
+    v = self.values()
+    lines = []
+
+    def metric(name, kind, helpText, samples):
+      lines.append('# HELP wrl_' + name + ' ' + helpText)
+      lines.append('# TYPE wrl_' + name + ' ' + kind)
+      for labels, value in samples:
+        lbl = ','.join(k + '="' + str(val).replace('\\', '\\\\').replace('"', '\\"') + '"' for k, val in labels)
+        lines.append('wrl_' + name + ('{' + lbl + '}' if lbl else '') + ' ' + str(value))
+
+    metric('queries_issued_total', 'counter', 'Queries handed to a worker slot',
+           [((('server', q['server']), ('case', q['case'])), q['issued']) for q in v['queries']])
+    metric('queries_completed_total', 'counter', 'Queries with a verdict',
+           [((('server', q['server']), ('case', q['case'])), q['completed']) for q in v['queries']])
+    metric('queries_in_flight', 'gauge', 'Queries issued and not yet completed',
+           [((('server', q['server']), ('case', q['case'])), q['in_flight']) for q in v['queries']])
+    metric('verdicts_total', 'counter', 'Completed queries by verdict',
+           [((('server', r['server']), ('case', r['case']), ('verdict', r['verdict'])), r['count'])
+              for r in v['verdicts']])
+    metric('timeouts_total', 'counter', 'Timed out queries by stage',
+           [((('stage', k),), n) for k, n in sorted(v['timeouts'].items())])
+
+    lag = v['lag']
+    metric('scheduler_lag_seconds', 'summary', 'Seconds between due time and dispatch of queries',
+           [((('quantile', q),), 0 if val is None else val) for q, val in lag['quantiles'].items()])
+    lines.append('wrl_scheduler_lag_seconds_sum ' + str(lag['sum']))
+    lines.append('wrl_scheduler_lag_seconds_count ' + str(lag['count']))
+    metric('scheduler_lag_max_seconds', 'gauge', 'Largest scheduler lag seen', [((), lag['max'])])
+
+    for name in sorted(self.gauges):
+      metric(name, 'gauge', name.replace('_', ' ').capitalize(), [((), v[name])])
+    metric('uptime_seconds', 'gauge', 'Seconds since start', [((), v['uptime'])])
+    return '\n'.join(lines) + '\n'
+
+
+  # Answer one HTTP request
+  async def handle(self, reader, writer):
+    try:
+      req = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+      while True: # Skip headers
+        line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+        if line in (b'\r\n', b'\n', b''):
+          break
+
+      parts = req.decode('latin-1').split()
+      path = parts[1].split('?')[0] if len(parts) > 1 else ''
+      if path == '/metrics':
+        status, ctype, body = '200 OK', 'text/plain; version=0.0.4', self.prometheus()
+      elif path == '/metrics.json':
+        status, ctype, body = '200 OK', 'application/json', json.dumps(self.values())
+      else:
+        status, ctype, body = '404 Not Found', 'text/plain', 'Not Found\n'
+      body = body.encode('utf-8')
+      writer.write(('HTTP/1.0 ' + status + '\r\nContent-Type: ' + ctype + '\r\nContent-Length: ' +
+                      str(len(body)) + '\r\nConnection: close\r\n\r\n').encode('latin-1') + body)
+      await writer.drain()
+    except (OSError, asyncio.TimeoutError):
+      pass
+    finally:
+      writer.close()
+
+
+  # Returns asyncio server answering scrapes on host:port
+  async def serve(self, host, port):
+    return await asyncio.start_server(self.handle, host, port)
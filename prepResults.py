@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 #  The file is part of the WRL Project.
 #
@@ -21,113 +21,313 @@ import os
 import sys
 import argparse
 import datetime
+import json
 import re
+import hashlib
+import concurrent.futures
+import resStore
+import latHist
 
+CHUNK_BYTES = 64 * 1048576 # Input files are split into chunks of this size for the worker processes
+NUM_CASES = 9 # Cases always printed, more are printed if the data has them
+HEAD_BYTES = 4096 # Bytes hashed to recognise a results file that was rotated or rewritten
 
-ap = argparse.ArgumentParser(description='Process results files into CSV')
-ap.add_argument(nargs='+', metavar='file', dest='infile', type=argparse.FileType('r'),
-                  default=sys.stdin, help='Results input file if not using stdin')
-ap.add_argument('-nf', '--total-nf', action='store_true', dest='nf', help='Total not FAILs')
-ap.add_argument('-bt', '--by-tld', action='store_true', dest='byTLD', help='Register PASS/FAIL by TLD instead of WHOIS server')
-ap.add_argument('-q', '--qh', action='store_true', dest='qh', help='Append queries/hour to output')
-ap.add_argument('-p', '--period', nargs=1, metavar='period', dest='period',
-                  type=int, default=None, required=False, help='Hardset time period in hours for all test cases')
-args = ap.parse_args()
-
-
-if args.nf:
-  nf = {}
-ts = {}
-servers = {}
-servers['header'] = ['tld_server', '0-pass', '0-fail', '0-noma',
-                       '1-pass', '1-fail', '1-noma',
-                       '2-pass', '2-fail', '2-noma',
-                       '3-pass', '3-fail', '3-noma',
-                       '4-pass', '4-fail', '4-noma',
-                       '5-pass', '5-fail', '5-noma',
-                       '6-pass', '6-fail', '6-noma',
-                       '7-pass', '7-fail', '7-noma',
-                       '8-pass', '8-fail', '8-noma']
-
-for f in args.infile:
-  for line in f.read().split('\n'):
-    if len(line) > 0:
-      if line.find('ActiveTestThreads') == -1:
-        toks = line.split(' ')
-        if args.byTLD:
-          tld_server = toks[3].split('.')[1] + '_' + toks[2]
-        else:
-          tld_server = toks[2]
-
-        if args.nf:
-          if tld_server not in nf:
-            nf[tld_server] = 0
-          if toks[1].find('FAIL') == -1:
-            nf[tld_server] += 1
-
-        if tld_server not in servers:
-          servers[tld_server] = []
-          ts[tld_server] = []
-          ts[tld_server].append(None)
-          for ii in range(len(servers['header']) - 1):
-            servers[tld_server].append(0)
-            if not ii % 3:
-              ts[tld_server].append(None)
-
-        case = int(toks[4].split('case-')[1].split('.')[0])
-        if not ts[tld_server][case]:
-          ts[tld_server][case] = toks[0]
-        if len(ts[tld_server]) == case + 2:
-          ts[tld_server][case+1] = toks[0]
-
-        if toks[1] == 'PASS':
-          servers[tld_server][(case * 3) + 0] += 1
-        elif toks[1] == 'NOMA':
-          servers[tld_server][(case * 3) + 2] += 1
-        else:
-          servers[tld_server][(case * 3) + 1] += 1
-
-rv = ''
-for h in servers['header']:
-  rv += h + ','
-if args.qh:
-  for ii in range((len(servers['header']) - 1) / 3):
-    rv += str(ii) + '-q/h,'
-if args.nf:
-  rv += 'not-fails'
-print(rv.strip(','))
-
-p = re.compile('\d+') # Regex to split timestamps
-for s in servers.iteritems():
-  if s[0] == 'header':
-    continue
-  rv = s[0] + ','
-  for c in s[1]:
-    rv += str(c) + ','
-  if args.qh:
-    for ii in range(len(ts[s[0]]) - 1): # Handle query/hour calculations
-      queries = int(sum(s[1][ii * 3: (ii * 3) + 3]) / len(args.infile))
-      if args.period:
-        qh = int(queries / args.period[0])
-      else:
-        if ts[s[0]][ii].find('/') == -1: # Old style dates, %H:%M:%S.%f
-          fHour, fMinute, fSecond, fMs = map(int, p.findall(ts[s[0]][ii]))
-          lHour, lMinute, lSecond, lMs = map(int, p.findall(ts[s[0]][ii+1]))
-          first = datetime.datetime(2017, 01, 15, fHour, fMinute, fSecond, fMs)
-          last = datetime.datetime(2017, 01, 15, lHour, lMinute, lSecond, lMs)
-          if last > first:
-            qh = int(queries / int((last - first).total_seconds() / 3600))
-          else:
-            qh = int(queries / int((86400 - (first - last).total_seconds()) / 3600))
-        else: # New style dates, %m/%d/%H:%M:%S.%f
-          fMonth, fDay, fHour, fMinute, fSecond, fMs = map(int, p.findall(ts[s[0]][ii]))
-          lMonth, lDay, lHour, lMinute, lSecond, lMs = map(int, p.findall(ts[s[0]][ii+1]))
-
-          first = datetime.datetime(2017, fMonth, fDay, fHour, fMinute, fSecond, fMs)
-          last = datetime.datetime(2017, lMonth, lDay, lHour, lMinute, lSecond, lMs)
-          qh = int(queries / (last - first).total_seconds() * 3600)
-      rv += str(qh) + ','
 
+# Returns JSON Lines results record as tokens of the text format plus its latency, None for events
+def jsonToks(line):
+  rec = json.loads(line)
+  if 'event' in rec:
+    return None
+  ts = datetime.datetime.fromtimestamp(rec['ts']).strftime("%m/%d/%H:%M:%S.%f")
+  return [ts, rec['verdict'], rec['server'], rec['domain'], rec['case'] + '.' + str(rec['rep']), rec.get('latency')]
+
+
+# Returns tokens of a results line, None for status and case boundary lines
+# Only results have 5 tokens, like in resStore.py
+def lineToks(line):
+  if line[0] == '{':
+    return jsonToks(line)
+  toks = line.split(' ')
+  if len(toks) != 5:
+    return None
+  return toks
+
+
+# Returns list of (fname, start, end) byte ranges splitting fname between offsets start and stop at line boundaries
+def chunks(fname, start, stop):
+  rv = []
+  with open(fname, 'rb') as f:
+    while start < stop:
+      f.seek(min(start + CHUNK_BYTES, stop))
+      f.readline()
+      end = min(f.tell(), stop)
+      rv.append((fname, start, end))
+      start = end
+  return rv
+
+
+# Returns byte offset just past the last complete line of fname, a partly written last line is left out
+def lastLineEnd(fname, size):
+  with open(fname, 'rb') as f:
+    pos = size
+    while pos > 0:
+      step = min(65536, pos)
+      f.seek(pos - step)
+      nl = f.read(step).rfind(b'\n')
+      if nl != -1:
+        return pos - step + nl + 1
+      pos -= step
+  return 0
+
+
+# Returns hash of the first length bytes of fname
+def headHash(fname, length):
+  with open(fname, 'rb') as f:
+    return hashlib.sha1(f.read(length)).hexdigest()
+
+
+# Returns incremental state from fname, a fresh one if missing or made with other options
+#  files = fname to inode, offset, headLen, head and the file's partial counts
+def loadState(fname, byTLD):
+  if os.path.exists(fname):
+    with open(fname, 'r') as f:
+      state = json.load(f)
+    if state['byTLD'] == byTLD:
+      for fs in state['files'].values():
+        for srv in fs['part'].values():
+          for k in ['counts', 'first', 'last']:
+            srv[k] = dict((int(case), v) for case, v in srv[k].items())
+          srv['lat'] = dict((int(case), latHist.LatHist(v)) for case, v in srv.get('lat', {}).items())
+      return state
+  return {'byTLD': byTLD, 'files': {}}
+
+
+def saveState(fname, state):
+  with open(fname + '.tmp', 'w') as f:
+    json.dump(state, f, default=latHist.LatHist.state)
+  os.replace(fname + '.tmp', fname)
+
+
+# Yields lines of fname between byte offsets start and end, '-' is stdin
+def chunkLines(fname, start, end):
+  if fname == '-':
+    for line in sys.stdin:
+      yield line.rstrip('\n')
+    return
+
+  with open(fname, 'rb') as f:
+    f.seek(start)
+    while f.tell() < end:
+      line = f.readline()
+      if not line:
+        break
+      yield line.decode('utf-8', 'replace').rstrip('\n')
+
+
+# Map step, aggregates one chunk
+# Returns dict of tld_server to partial counts, in order of first appearance
+#  counts = case to [pass, fail, noma]
+#  first, last = case to first and last timestamp string seen
+#  nf = count of not FAILs
+#  lat = case to latHist.LatHist of query latencies, only JSON Lines results have them
+def parseChunk(task):
+  fname, start, end, byTLD = task
+  part = {}
+  for line in chunkLines(fname, start, end):
+    if len(line) == 0:
+      continue
+    toks = lineToks(line)
+    if not toks:
+      continue
+
+    if byTLD:
+      tld_server = toks[3].split('.')[1] + '_' + toks[2]
+    else:
+      tld_server = toks[2]
+
+    if tld_server not in part:
+      part[tld_server] = {'counts': {}, 'first': {}, 'last': {}, 'nf': 0, 'lat': {}}
+    srv = part[tld_server]
+
+    if toks[1].find('FAIL') == -1:
+      srv['nf'] += 1
+
+    case = int(toks[4].split('case-')[1].split('.')[0])
+    if case not in srv['counts']:
+      srv['counts'][case] = [0, 0, 0]
+      srv['first'][case] = toks[0]
+    srv['last'][case] = toks[0]
+    if len(toks) > 5 and toks[5] is not None:
+      if case not in srv['lat']:
+        srv['lat'][case] = latHist.LatHist()
+      srv['lat'][case].add(toks[5])
+
+    if toks[1] == 'PASS':
+      srv['counts'][case][0] += 1
+    elif toks[1] == 'NOMA':
+      srv['counts'][case][2] += 1
+    else:
+      srv['counts'][case][1] += 1
+  return part
+
+
+# Returns partial counts of a resStore.py store, timestamps formatted as in the text format
+def storePart(fname, byTLD):
+  part = resStore.load(fname).counts(byTLD)
+  for srv in part.values():
+    for k in ['first', 'last']:
+      srv[k] = dict((case, datetime.datetime.fromtimestamp(ts).strftime("%m/%d/%H:%M:%S.%f"))
+                      for case, ts in srv[k].items())
+  return part
+
+
+# Reduce step, merges partial results in input order into total
+def merge(total, part):
+  for tld_server, srv in part.items():
+    if tld_server not in total:
+      total[tld_server] = {'counts': {}, 'first': {}, 'last': {}, 'nf': 0, 'lat': {}}
+    tot = total[tld_server]
+    tot['nf'] += srv['nf']
+    for case, hist in srv['lat'].items():
+      if case not in tot['lat']:
+        tot['lat'][case] = latHist.LatHist()
+      tot['lat'][case].merge(hist)
+    for case, cnt in srv['counts'].items():
+      if case not in tot['counts']:
+        tot['counts'][case] = [0, 0, 0]
+        tot['first'][case] = srv['first'][case]
+      tot['last'][case] = srv['last'][case]
+      for ii in range(3):
+        tot['counts'][case][ii] += cnt[ii]
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Process results files into CSV')
+  ap.add_argument(nargs='+', metavar='file', dest='infile', type=str,
+                    help='Results input file, - for stdin, .npz for a resStore.py store')
+  ap.add_argument('-nf', '--total-nf', action='store_true', dest='nf', help='Total not FAILs')
+  ap.add_argument('-bt', '--by-tld', action='store_true', dest='byTLD', help='Register PASS/FAIL by TLD instead of WHOIS server')
+  ap.add_argument('-q', '--qh', action='store_true', dest='qh', help='Append queries/hour to output')
+  ap.add_argument('-p', '--period', nargs=1, metavar='period', dest='period',
+                    type=int, default=None, required=False, help='Hardset time period in hours for all test cases')
+  ap.add_argument('-c', '--cases', dest='cases', type=int, default=NUM_CASES,
+                    help='Minimum number of cases to print')
+  ap.add_argument('-j', '--jobs', dest='jobs', type=int, default=os.cpu_count(), help='Worker processes')
+  ap.add_argument('-l', '--latency', action='store_true', dest='latency',
+                    help='Append latency percentiles in seconds of each case, 0 where there are none')
+  ap.add_argument('-i', '--incremental', metavar='state', dest='state', type=str, default=None,
+                    help='State file, only lines appended since the last run with it are parsed')
+  args = ap.parse_args()
+
+  # Each file is aggregated on its own so a rotated or truncated file can be redone alone
+  # In incremental mode a file continues from its saved offset if it is still the same file
+  if args.state:
+    state = loadState(args.state, args.byTLD)
+  parts = {}
+  tasks = []
+  for fname in args.infile:
+    parts[fname] = {}
+    if fname == '-':
+      tasks.append(('-', 0, 0, args.byTLD))
+      continue
+    if fname.endswith('.npz'):
+      parts[fname] = storePart(fname, args.byTLD)
+      continue
+
+    st = os.stat(fname)
+    start, stop = 0, st.st_size
+    if args.state:
+      stop = lastLineEnd(fname, st.st_size)
+      fs = state['files'].get(fname)
+      if fs and fs['inode'] == st.st_ino and fs['offset'] <= stop and headHash(fname, fs['headLen']) == fs['head']:
+        start = fs['offset']
+        parts[fname] = fs['part']
+      headLen = min(stop, HEAD_BYTES)
+      state['files'][fname] = {'inode': st.st_ino, 'offset': stop, 'headLen': headLen,
+                                 'head': headHash(fname, headLen), 'part': parts[fname]}
+    tasks.extend(c + (args.byTLD,) for c in chunks(fname, start, stop))
+
+  if len(tasks) > 1 and '-' not in args.infile:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+      for task, part in zip(tasks, pool.map(parseChunk, tasks)):
+        merge(parts[task[0]], part)
+  else:
+    for task in tasks:
+      merge(parts[task[0]], parseChunk(task))
+
+  if args.state:
+    for fname in list(state['files']):
+      if fname not in parts:
+        del state['files'][fname]
+    saveState(args.state, state)
+
+  servers = {}
+  for fname in args.infile:
+    merge(servers, parts[fname])
+
+  numCases = args.cases
+  for srv in servers.values():
+    if srv['counts']:
+      numCases = max(numCases, max(srv['counts']) + 1)
+
+  rv = 'tld_server,'
+  for ii in range(numCases):
+    rv += str(ii) + '-pass,' + str(ii) + '-fail,' + str(ii) + '-noma,'
+  if args.qh:
+    for ii in range(numCases):
+      rv += str(ii) + '-q/h,'
+  if args.latency:
+    for ii in range(numCases):
+      for pct in latHist.PERCENTILES:
+        rv += str(ii) + '-p' + str(pct) + ','
   if args.nf:
-    rv += str(nf[s[0]])
+    rv += 'not-fails'
   print(rv.strip(','))
+
+  p = re.compile(r'\d+') # Regex to split timestamps
+  for tld_server, srv in servers.items():
+    counts = []
+    for ii in range(numCases):
+      counts.extend(srv['counts'].get(ii, [0, 0, 0]))
+    # First timestamp of each case, then the last timestamp of the last case
+    ts = [srv['first'].get(ii) for ii in range(numCases)] + [srv['last'].get(numCases - 1)]
+
+    rv = tld_server + ','
+    for c in counts:
+      rv += str(c) + ','
+    if args.qh:
+      for ii in range(numCases): # Handle query/hour calculations
+        queries = int(sum(counts[ii * 3: (ii * 3) + 3]) / len(args.infile))
+        if args.period:
+          qh = int(queries / args.period[0])
+        elif ts[ii] is None or ts[ii+1] is None: # Case not run
+          qh = 0
+        else:
+          if ts[ii].find('/') == -1: # Old style dates, %H:%M:%S.%f
+            fHour, fMinute, fSecond, fMs = map(int, p.findall(ts[ii]))
+            lHour, lMinute, lSecond, lMs = map(int, p.findall(ts[ii+1]))
+            first = datetime.datetime(2017, 1, 15, fHour, fMinute, fSecond, fMs)
+            last = datetime.datetime(2017, 1, 15, lHour, lMinute, lSecond, lMs)
+            if last > first:
+              qh = int(queries / int((last - first).total_seconds() / 3600))
+            else:
+              qh = int(queries / int((86400 - (first - last).total_seconds()) / 3600))
+          else: # New style dates, %m/%d/%H:%M:%S.%f
+            fMonth, fDay, fHour, fMinute, fSecond, fMs = map(int, p.findall(ts[ii]))
+            lMonth, lDay, lHour, lMinute, lSecond, lMs = map(int, p.findall(ts[ii+1]))
+
+            first = datetime.datetime(2017, fMonth, fDay, fHour, fMinute, fSecond, fMs)
+            last = datetime.datetime(2017, lMonth, lDay, lHour, lMinute, lSecond, lMs)
+            qh = int(queries / (last - first).total_seconds() * 3600)
+        rv += str(qh) + ','
+
+    if args.latency:
+      for ii in range(numCases):
+        pcts = srv['lat'][ii].percentiles() if ii in srv['lat'] else {}
+        for pct in latHist.PERCENTILES:
+          q = pcts.get('p' + str(pct))
+          rv += ('%.4f' % q if q is not None else '0') + ','
+
+    if args.nf:
+      rv += str(srv['nf'])
+    print(rv.strip(','))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# RDAP domain lookups for wrl.py, RFC 7482
+#
+# A subject line whose server is an http:// or https:// base URL is queried over RDAP instead of port 43
+#  https://rdap.nic.example/,foo.example,bar.example
+# Requests go through an httpPool.HttpPool on executor threads so connections to each server are kept alive
+# Errors are raised as whoisClient.WhoisTimeout and WhoisError so wrl.py handles both protocols alike
+#
+# Responses are kept in the debug store as a status line, the Retry-After header if any, a blank line and the body
+#  HTTP 429
+#  Retry-After: 60
+#
+#  {"errorCode": 429, ...}
+
+import sys
+import time
+import asyncio
+import email.utils
+import http.client
+import urllib.parse
+import httpPool
+import whoisClient
+
+
+#############
+# CONSTANTS #
+#############
+
+TOTAL_TIMEOUT = 10 # Seconds to wait for the whole query
+ACCEPT = 'application/rdap+json, application/json'
+MAX_BYTES = 65536 # Bytes of response body kept for debugging
+
+
+####################
+# GLOBAL FUNCTIONS #
+####################
+
+# Returns True if subject line server is an RDAP base URL
+def isRdap(server):
+  return server.startswith('http://') or server.startswith('https://')
+
+
+# Returns domain lookup URL of base URL
+def url(base, domain):
+  return base.rstrip('/') + '/domain/' + urllib.parse.quote(domain.encode('idna').decode('ascii'))
+
+
+# Returns host name of base URL
+def host(base):
+  return urllib.parse.urlsplit(base).hostname
+
+
+# Returns seconds asked for by the Retry-After header in headers, None if missing or unreadable
+# The header is either a number of seconds or an HTTP date
+def retryAfter(headers):
+  val = headers.get('retry-after')
+  if val is None:
+    return None
+  val = val.strip()
+  if val.isdigit():
+    return int(val)
+  try:
+    return max(0, int(email.utils.parsedate_to_datetime(val).timestamp() - time.time()))
+  except (TypeError, ValueError):
+    return None
+
+
+# Returns response as kept in the debug store
+def dbgBody(status, headers, body):
+  rv = "HTTP " + str(status) + "\n"
+  if 'retry-after' in headers:
+    rv += "Retry-After: " + headers['retry-after'] + "\n"
+  return rv + "\n" + body[:MAX_BYTES]
+
+
+# Returns (status, body) of a response kept by dbgBody(), status is None if rs is not one
+def parseDbgBody(rs):
+  head, _, body = rs.partition("\n\n")
+  toks = head.split("\n", 1)[0].split(' ')
+  if len(toks) != 2 or toks[0] != 'HTTP' or not toks[1].isdigit():
+    return None, rs
+  return int(toks[1]), body
+
+
+# Look up domain at RDAP base URL
+# Returns (status, headers dict with lowercase names, decoded body), raises WhoisTimeout or WhoisError
+# timing = optional dict receiving the response timing, the seconds from sending the request to the response,
+# and 'addr', the address of the server queried once connected
+async def query(pool, base, domain, executor=None, totalTimeout=TOTAL_TIMEOUT, timing=None):
+  loop = asyncio.get_running_loop()
+  if timing is None:
+    timing = {}
+  info = {}
+  start = time.monotonic()
+  try:
+    status, headers, body = await asyncio.wait_for(
+      loop.run_in_executor(executor, pool.request, 'GET', url(base, domain), {'Accept': ACCEPT}, info), totalTimeout)
+  except (asyncio.TimeoutError, TimeoutError): # The same class since Python 3.11
+    if time.monotonic() - start >= totalTimeout:
+      raise whoisClient.WhoisTimeout('total', '')
+    raise whoisClient.WhoisTimeout('read', '')
+  except (OSError, http.client.HTTPException) as e:
+    raise whoisClient.WhoisError(type(e).__name__ + ':' + str(e), '')
+  finally:
+    if 'peer' in info:
+      timing['addr'] = info['peer']
+  timing['response'] = time.monotonic() - start
+  return status, headers, whoisClient.decode(body)
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 3:
+    print("rdapClient.py BASE_URL DOMAIN")
+    exit(0)
+
+  pool = httpPool.HttpPool()
+  status, headers, body = asyncio.run(query(pool, sys.argv[1], sys.argv[2]))
+  print(dbgBody(status, headers, body))
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Reclassifies whois responses kept in debug logs without sending any queries
+#
+# Reads debug stores written by wrl.py, see dbgStore.py, and old plain text dbg_ files
+# Every stored response is classified again with the current classify.py and an indicator profile
+# RDAP responses are classified again by their HTTP status and body, profiles do not apply to them
+# Prints server,old,new,count for each change of verdict, most frequent first
+# Queries that failed before a response was classified, e.g. FAIL_timeout, are skipped
+# Responses wrl.py stopped reading once their verdict was certain are counted as truncated and not replayed,
+# under another profile the unread rest could change their verdict
+#
+# Replaces checkNoMatch.sh, its check is
+#  replayDbg.py -V PASS_no_match dbg_thi*_2017*.txt
+
+import os
+import sys
+import argparse
+import concurrent.futures
+import classify
+import dbgStore
+import rdapClient
+
+CHUNK_BYTES = 16 * 1048576 # Index and text files are split into chunks of this size for the worker processes
+TEXT_HEAD = b'>whois -h ' # Starts the line of every query in a plain text dbg_ file, after an empty line
+REPLAYED = ('PASS', 'NOMA', 'FAIL') # Verdicts given by classification, FAIL_timeout etc. are not
+
+classifier = None # Classifier of this worker process
+
+
+# Set classifier of this worker process from JSON profile file, None for the default profile
+def init(profile):
+  global classifier
+  if profile:
+    classifier = classify.load(profile)
+  else:
+    classifier = classify.Classifier()
+
+
+# Returns True if verdict came from classifying a response
+def replayable(verdict):
+  return verdict in REPLAYED or verdict.startswith('PASS_')
+
+
+# Returns debug store verdict of response rs to a query of server for domain
+# Responses of RDAP servers are classified by their kept HTTP status, see rdapClient.dbgBody()
+def reclassify(rs, server, domain):
+  if rdapClient.isRdap(server):
+    status, body = rdapClient.parseDbgBody(rs)
+    return classify.dbgVerdict(*classify.classifyRdap(status, body, domain))
+  return classify.dbgVerdict(*classifier.classify(rs, server, domain))
+
+
+# Returns offset of the first query line in text file f after offset pos, size if there is none
+def nextQuery(f, pos, size):
+  if pos >= size:
+    return size
+  f.seek(max(0, pos - 1))
+  f.readline() # Rest of the line pos is in, it can not tell if the next line starts a query
+  prev = None
+  while True:
+    off = f.tell()
+    line = f.readline()
+    if not line:
+      return size
+    if prev == b'\n' and line.startswith(TEXT_HEAD):
+      return off
+    prev = line
+
+
+# Returns list of (kind, fname, start, stop) tasks for debug store or text file fname
+# Text files are split at the start of a query
+def tasks(fname):
+  if os.path.exists(dbgStore.baseName(fname) + dbgStore.IDX_SUFFIX):
+    base = dbgStore.baseName(fname)
+    size = os.path.getsize(base + dbgStore.IDX_SUFFIX)
+    rv = []
+    with open(base + dbgStore.IDX_SUFFIX, 'rb') as f:
+      start = 0
+      while start < size:
+        f.seek(min(start + CHUNK_BYTES, size))
+        f.readline()
+        rv.append(('store', base, start, f.tell()))
+        start = f.tell()
+    return rv
+
+  size = os.path.getsize(fname)
+  rv = []
+  with open(fname, 'rb') as f:
+    start = 0
+    while start < size:
+      stop = nextQuery(f, start + CHUNK_BYTES, size)
+      rv.append(('text', fname, start, stop))
+      start = stop
+  return rv
+
+
+# Yields (label, server, domain, old verdict, body, stopped) of queries in a plain text dbg_ file
+# start and stop = byte range of the file to read, start must be 0 or the start of a query, see nextQuery()
+# Read line by line so only one body is held at a time
+# label is the byte offset of the query in the file as the old format has no time or case
+def textQueries(fname, start=0, stop=None):
+  def query(pos, head, body, more):
+    toks = head[len(TEXT_HEAD):].rstrip(b'\n').decode('utf-8', 'surrogateescape').split(' ')
+    body = b''.join(body)
+    if more: # Drop the line end and empty line before the next query
+      body = body[:-2]
+    if len(toks) == 3:
+      return fname + ':' + str(pos), toks[0], toks[1], toks[2], body.decode('utf-8', 'surrogateescape'), False
+    return None
+
+  with open(fname, 'rb') as f:
+    f.seek(start)
+    pos = start
+    prev = b'\n' if start else None
+    cur = None # (offset, query line) of the query being read
+    body = []
+    for line in f:
+      if prev == b'\n' and line.startswith(TEXT_HEAD):
+        if cur:
+          q = query(cur[0], cur[1], body, True)
+          if q:
+            yield q
+        if stop is not None and pos >= stop:
+          return
+        cur = (pos, line)
+        body = []
+      elif cur:
+        body.append(line)
+      pos += len(line)
+      prev = line
+    if cur:
+      q = query(cur[0], cur[1], body, False)
+      if q:
+        yield q
+
+
+# Yields (label, server, domain, old verdict, body hash, stopped, store reader) of queries in a debug store index range
+def storeQueries(base, start, stop):
+  rd = dbgStore.DbgReader(base)
+  try:
+    for ts, server, domain, case, rep, verdict, h, stopped in rd.records(start, stop):
+      yield '%.6f' % ts + ' ' + case + '.' + str(rep), server, domain, verdict, h, stopped, rd
+  finally:
+    rd.close()
+
+
+# Replays one task in a worker process
+# only = verdict prefix of the queries to replay, None for all
+# Returns (counts, changes, replayed, skipped, truncated), counts is a dict of (server, old, new) to count
+# changes is a list of (label, server, domain, old, new), filled in only if verbose
+def replay(task, only=None, verbose=False):
+  kind, fname, start, stop = task
+  counts = {}
+  changes = []
+  replayed = skipped = truncated = 0
+  if kind == 'store':
+    queries = storeQueries(fname, start, stop)
+  else:
+    queries = (q + (None,) for q in textQueries(fname, start, stop))
+
+  cache = {} # (hash, server, domain) to verdict, stores keep identical responses once
+  for label, server, domain, old, body, stopped, rd in queries:
+    if only and not old.startswith(only):
+      continue
+    if not replayable(old):
+      skipped += 1
+      continue
+    if stopped:
+      truncated += 1
+      continue
+
+    if rd:
+      key = (body, server, domain)
+      if key in cache:
+        new = cache[key]
+      else:
+        rs = rd.body(body)
+        if rs is None: # Lost in an unflushed block
+          skipped += 1
+          continue
+        new = cache[key] = reclassify(rs, server, domain)
+    else:
+      new = reclassify(body, server, domain)
+
+    replayed += 1
+    if new != old:
+      counts[(server, old, new)] = counts.get((server, old, new), 0) + 1
+      if verbose:
+        changes.append((label, server, domain, old, new))
+  return counts, changes, replayed, skipped, truncated
+
+
+def replayTask(args):
+  return replay(*args)
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Reclassify whois responses in debug logs without querying')
+  ap.add_argument('files', type=str, nargs='+', help='Debug stores, any of their files, or plain text dbg_ files')
+  ap.add_argument('-p', '--profile', dest='profile', type=str, default=None,
+                    help='Indicator profile JSON, see classify.py, default is the built in profile')
+  ap.add_argument('-V', '--verdict', dest='only', type=str, default=None,
+                    help='Replay only queries whose old verdict starts with this, e.g. PASS_no_match')
+  ap.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
+                    help='Also print every changed query')
+  ap.add_argument('-j', '--jobs', dest='jobs', type=int, default=os.cpu_count(), help='Worker processes')
+  args = ap.parse_args()
+
+  work = []
+  seen = set()
+  for fname in args.files:
+    for task in tasks(fname):
+      if task not in seen: # A store can be named by each of its files
+        seen.add(task)
+        work.append((task, args.only, args.verbose))
+
+  if args.jobs > 1 and len(work) > 1:
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=init, initargs=(args.profile,))
+    results = pool.map(replayTask, work)
+  else:
+    init(args.profile)
+    pool = None
+    results = map(replayTask, work)
+
+  counts = {}
+  replayed = skipped = truncated = 0
+  for part, changes, n, s, t in results:
+    for key, c in part.items():
+      counts[key] = counts.get(key, 0) + c
+    replayed += n
+    skipped += s
+    truncated += t
+    for label, server, domain, old, new in changes:
+      print(label + " " + server + " " + domain + " " + old + " " + new, file=sys.stderr)
+  if pool:
+    pool.shutdown()
+
+  print("server,old,new,count")
+  for (server, old, new), c in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])):
+    print(server + ',' + old + ',' + new + ',' + str(c))
+  print("replayed:" + str(replayed) + " changed:" + str(sum(counts.values())) + " skipped:" + str(skipped) +
+          " truncated:" + str(truncated), file=sys.stderr)
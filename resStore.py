@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Columnar results store
+# Query results are kept as NumPy arrays in one uncompressed .npz file so analyses load them without parsing text
+#
+# Columns, one entry per query
+#  ts = int64 microseconds since the epoch
+#  case = int16 case number, rep = int32 repetition
+#  latency, connect, response = float32 seconds, NaN when the log did not record them, see resWriter.py
+#  server, domain, verdict, ip = int32 codes into the dictionary arrays servers, domains, verdicts and ips
+#
+# Text res_ lines carry no year, it is taken from the file's mtime and lines with a later month
+# than the mtime are put in the year before. Old style lines carry no date, they are put on January 1st
+# Status and case boundary events are not stored
+
+import os
+import json
+import time
+import argparse
+import concurrent.futures
+import numpy as np
+import latHist
+
+CHUNK_BYTES = 64 * 1048576 # Input files are split into chunks of this size for the worker processes
+DICTS = ['server', 'domain', 'verdict', 'ip'] # Dictionary encoded columns
+COLUMNS = [('ts', np.int64), ('case', np.int16), ('rep', np.int32), ('latency', np.float32),
+           ('connect', np.float32), ('response', np.float32)] + \
+  [(c, np.int32) for c in DICTS]
+CLASSES = ['pass', 'fail', 'noma'] # Verdict classes in the order prepResults.py prints them
+
+
+# Returns class index of verdict string, anything not PASS or NOMA is a FAIL
+def verdictClass(verdict):
+  if verdict == 'PASS':
+    return 0
+  if verdict == 'NOMA':
+    return 2
+  return 1
+
+
+# Returns list of (fname, start, end) byte ranges splitting fname at line boundaries
+def chunks(fname):
+  size = os.path.getsize(fname)
+  rv = []
+  start = 0
+  with open(fname, 'rb') as f:
+    while start < size:
+      f.seek(min(start + CHUNK_BYTES, size))
+      f.readline()
+      end = min(f.tell(), size)
+      rv.append((fname, start, end))
+      start = end
+  return rv
+
+
+# Returns microseconds since the epoch of a text res_ timestamp, %m/%d/%H:%M:%S.%f or %H:%M:%S.%f
+# bases caches the epoch of each hour seen
+def textTs(ts, year, month, bases):
+  if ts[2] == '/':
+    key = ts[:8]
+  else:
+    key = '01/01/' + ts[:2]
+    ts = '01/01/' + ts
+  if key not in bases:
+    mm = int(key[:2])
+    tt = (year - 1 if mm > month else year, mm, int(key[3:5]), int(key[6:8]), 0, 0, 0, 0, -1)
+    bases[key] = int(time.mktime(tt)) * 1000000
+  return bases[key] + int(ts[9:11]) * 60000000 + int(ts[12:14]) * 1000000 + int(ts[15:21])
+
+
+# Parses one chunk of a results file
+# Returns dict of column arrays and dictionary lists, codes are local to the chunk
+def parseChunk(task):
+  fname, start, end = task
+  mt = time.localtime(os.path.getmtime(fname))
+  cols = dict((c, []) for c, _ in COLUMNS)
+  codes = dict((c, {}) for c in DICTS)
+  bases = {}
+
+  with open(fname, 'rb') as f:
+    f.seek(start)
+    while f.tell() < end:
+      line = f.readline()
+      if not line:
+        break
+      line = line.decode('utf-8', 'replace').rstrip('\n')
+      if len(line) == 0:
+        continue
+
+      if line[0] == '{':
+        rec = json.loads(line)
+        if 'event' in rec:
+          continue
+        ts = int(round(rec['ts'] * 1000000))
+        vals = [rec['server'], rec['domain'], rec['verdict'], rec.get('ip', '')]
+        case, rep = rec['case'], rec['rep']
+        timings = [rec.get(k) for k in ['latency', 'connect', 'response']]
+      else:
+        toks = line.split(' ')
+        if len(toks) != 5: # Status and case boundary lines
+          continue
+        ts = textTs(toks[0], mt.tm_year, mt.tm_mon, bases)
+        vals = [toks[2], toks[3], toks[1], '']
+        case, rep = toks[4].rsplit('.', 1)
+        timings = [None, None, None]
+
+      cols['ts'].append(ts)
+      cols['case'].append(int(case.split('case-')[1]))
+      cols['rep'].append(int(rep))
+      for k, v in zip(['latency', 'connect', 'response'], timings):
+        cols[k].append(np.nan if v is None else v)
+      for c, v in zip(DICTS, vals):
+        cols[c].append(codes[c].setdefault(v, len(codes[c])))
+
+  rv = dict((c, np.array(cols[c], dtype=dt)) for c, dt in COLUMNS)
+  for c in DICTS:
+    rv[c + 's'] = list(codes[c])
+  return rv
+
+
+# Query results held as columns
+class ResStore():
+  def __init__(self, cols):
+    self.cols = cols
+
+
+  def __len__(self):
+    return len(self.cols['ts'])
+
+
+  # Returns column decoded to its values
+  def values(self, name):
+    if name in DICTS:
+      return self.cols[name + 's'][self.cols[name]]
+    return self.cols[name]
+
+
+  # Returns code of value in a dictionary column, -1 if absent
+  def code(self, name, value):
+    hits = np.flatnonzero(self.cols[name + 's'] == value)
+    return int(hits[0]) if len(hits) else -1
+
+
+  # Returns store of the queries matching all given arguments, dictionaries are shared
+  # verdict = PASS, NOMA, FAIL for the whole class or a full verdict such as FAIL_timeout
+  # start, end = seconds since the epoch, end exclusive
+  def select(self, server=None, domain=None, case=None, verdict=None, start=None, end=None):
+    mask = np.ones(len(self), dtype=bool)
+    if server is not None:
+      mask &= self.cols['server'] == self.code('server', server)
+    if domain is not None:
+      mask &= self.cols['domain'] == self.code('domain', domain)
+    if case is not None:
+      mask &= self.cols['case'] == case
+    if verdict is not None:
+      if verdict == 'FAIL':
+        mask &= self.classes() == 1
+      else:
+        mask &= self.cols['verdict'] == self.code('verdict', verdict)
+    if start is not None:
+      mask &= self.cols['ts'] >= int(start * 1000000)
+    if end is not None:
+      mask &= self.cols['ts'] < int(end * 1000000)
+
+    cols = dict((c, self.cols[c][mask]) for c, _ in COLUMNS)
+    for c in DICTS:
+      cols[c + 's'] = self.cols[c + 's']
+    return ResStore(cols)
+
+
+  # Returns verdict class of every query, index into CLASSES
+  def classes(self):
+    return np.array([verdictClass(v) for v in self.cols['verdicts']], dtype=np.int8)[self.cols['verdict']]
+
+
+  # Returns key code of every query and the key names
+  # Keys are servers, or tld_server when byTLD
+  def keys(self, byTLD=False):
+    if not byTLD:
+      return self.cols['server'], self.cols['servers']
+    tlds, tldCodes = np.unique([d.split('.')[1] if '.' in d else '' for d in self.cols['domains']], return_inverse=True)
+    combo = tldCodes[self.cols['domain']].astype(np.int64) * len(self.cols['servers']) + self.cols['server']
+    uniq, inv = np.unique(combo, return_inverse=True)
+    names = np.array([tlds[u // len(self.cols['servers'])] + '_' + self.cols['servers'][u % len(self.cols['servers'])]
+                        for u in uniq])
+    return inv, names
+
+
+  # Returns dict of key to per case counts and time range, in order of first appearance
+  #  counts = case to [pass, fail, noma]
+  #  first, last = case to seconds since the epoch of first and last query
+  #  nf = count of not FAILs
+  #  lat = case to latHist.LatHist of query latencies
+  def counts(self, byTLD=False):
+    if len(self) == 0:
+      return {}
+    key, names = self.keys(byTLD)
+    numCases = int(self.cols['case'].max()) + 1
+    cls = self.classes()
+    cell = key.astype(np.int64) * numCases + self.cols['case']
+    tally = np.bincount(cell * 3 + cls, minlength=len(names) * numCases * 3).reshape(len(names), numCases, 3)
+
+    # Queries are in log order so the first and last occurrence of each cell are its time range
+    cells, firstIdx = np.unique(cell, return_index=True)
+    _, lastIdx = np.unique(cell[::-1], return_index=True)
+    lastIdx = len(cell) - 1 - lastIdx
+    ts = self.cols['ts'] / 1000000.0
+
+    rv = {}
+    seen, keyFirst = np.unique(key, return_index=True)
+    for k in seen[np.argsort(keyFirst)]:
+      rv[str(names[k])] = {'counts': {}, 'first': {}, 'last': {}, 'nf': 0, 'lat': {}}
+    for c, fi, li in zip(cells, firstIdx, lastIdx):
+      k, case = int(c // numCases), int(c % numCases)
+      srv = rv[str(names[k])]
+      srv['counts'][case] = [int(n) for n in tally[k, case]]
+      srv['first'][case] = float(ts[fi])
+      srv['last'][case] = float(ts[li])
+      srv['nf'] += int(tally[k, case, 0] + tally[k, case, 2])
+
+    # Bucket latencies as latHist.bucket() does, then count each (cell, bucket) pair
+    lat = self.cols['latency'].astype(np.float64)
+    has = ~np.isnan(lat)
+    with np.errstate(divide='ignore'):
+      b = np.ceil(np.log(np.maximum(lat[has], latHist.MIN_VALUE) / latHist.MIN_VALUE) / latHist.LOG_GROWTH)
+    b = np.minimum(b, latHist.MAX_BUCKET).astype(np.int64)
+    pairs, n = np.unique(cell[has] * (latHist.MAX_BUCKET + 1) + b, return_counts=True)
+    for pair, cnt in zip(pairs, n):
+      c, bb = divmod(int(pair), latHist.MAX_BUCKET + 1)
+      lats = rv[str(names[c // numCases])]['lat']
+      if c % numCases not in lats:
+        lats[c % numCases] = latHist.LatHist()
+      lats[c % numCases].counts[bb] = int(cnt)
+      lats[c % numCases].n += int(cnt)
+    return rv
+
+
+  # Returns (first, last) seconds since the epoch of matching queries, None if there are none
+  def timeRange(self, server=None, case=None):
+    ts = self.select(server=server, case=case).cols['ts']
+    if len(ts) == 0:
+      return None
+    return int(ts.min()) / 1000000.0, int(ts.max()) / 1000000.0
+
+
+  def save(self, fname):
+    with open(fname, 'wb') as f:
+      np.savez(f, **self.cols)
+
+
+# Returns ResStore from file written by ResStore.save()
+def load(fname):
+  with np.load(fname) as npz:
+    return ResStore(dict((k, npz[k]) for k in npz.files))
+
+
+# Returns one ResStore of parts in order, dictionaries are merged and codes remapped
+def concat(parts):
+  dicts = dict((c, {}) for c in DICTS)
+  cols = dict((c, []) for c, _ in COLUMNS)
+  for part in parts:
+    for c, _ in COLUMNS:
+      if c in DICTS:
+        remap = np.array([dicts[c].setdefault(v, len(dicts[c])) for v in part[c + 's']], dtype=np.int32)
+        cols[c].append(remap[part[c]] if len(remap) else part[c])
+      else:
+        cols[c].append(part[c])
+
+  rv = {}
+  for c, dt in COLUMNS:
+    rv[c] = np.concatenate(cols[c]) if cols[c] else np.zeros(0, dtype=dt)
+  for c in DICTS:
+    rv[c + 's'] = np.array(list(dicts[c]), dtype=str)
+  return ResStore(rv)
+
+
+# Returns ResStore of results files, parsed in parallel
+def convert(fnames, jobs=None):
+  tasks = []
+  for fname in fnames:
+    tasks.extend(chunks(fname))
+  if len(tasks) > 1:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+      return concat(pool.map(parseChunk, tasks))
+  return concat(parseChunk(t) for t in tasks)
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Columnar store of wrl.py results')
+  ap.add_argument('cmd', choices=['convert', 'stats', 'show'],
+                    help='convert = res_ files to a store, stats = per server and case counts, show = matching queries')
+  ap.add_argument(nargs='+', metavar='file', dest='infile', type=str,
+                    help='Results files for convert, stores for stats and show')
+  ap.add_argument('-o', '--out', dest='out', type=str, default=None, help='Store written by convert')
+  ap.add_argument('-j', '--jobs', dest='jobs', type=int, default=os.cpu_count(), help='Worker processes')
+  ap.add_argument('-bt', '--by-tld', dest='byTLD', action='store_true', default=False,
+                    help='Stats per tld_server instead of server')
+  ap.add_argument('-s', '--server', dest='server', type=str, default=None, help='Whois server')
+  ap.add_argument('-c', '--case', dest='case', type=int, default=None, help='Case number')
+  ap.add_argument('-v', '--verdict', dest='verdict', type=str, default=None, help='PASS, NOMA, FAIL or a full verdict')
+  args = ap.parse_args()
+
+  if args.cmd == 'convert':
+    if not args.out:
+      ap.error('convert needs -o')
+    st = convert(args.infile, args.jobs)
+    st.save(args.out)
+    print("queries:" + str(len(st)) + " servers:" + str(len(st.cols['servers'])) +
+            " domains:" + str(len(st.cols['domains'])) + " bytes:" + str(os.path.getsize(args.out)))
+    exit(0)
+
+  st = concat(load(f).cols for f in args.infile).select(args.server, None, args.case, args.verdict)
+  if args.cmd == 'stats':
+    print('key,case,pass,fail,noma,first,last')
+    for key, srv in st.counts(args.byTLD).items():
+      for case in sorted(srv['counts']):
+        print(key + ',' + str(case) + ',' + ','.join(str(n) for n in srv['counts'][case]) + ',' +
+                '%.6f' % srv['first'][case] + ',' + '%.6f' % srv['last'][case])
+
+  elif args.cmd == 'show':
+    cols = [st.values(c) for c in ['ts', 'verdict', 'server', 'domain', 'case', 'rep', 'latency', 'ip']]
+    for ts, verdict, server, domain, case, rep, latency, ip in zip(*cols):
+      print('%.6f' % (ts / 1000000.0) + " " + verdict + " " + server + " " + domain + " case-" + str(case) + "." +
+              str(rep) + " " + ('-' if np.isnan(latency) else '%.6f' % latency) + " " + (ip or '-'))
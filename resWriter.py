@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Batched results writer for wrl.py
+#
+# Records are queued by the caller and formatted and written by one writer thread
+# The batch is written when it reaches BATCH_LINES or is FLUSH_INTERVAL seconds old, and on close()
+#
+# JSON Lines records, one per line
+#  {"ts": 1516000000.123456, "verdict": "PASS", "server": "whois.nic.example", "domain": "foo.example",
+#   "case": "case-0", "rep": 3, "latency": 0.0421, "ip": "192.0.2.43", "connect": 0.0113, "response": 0.0298,
+#   "stopped": false}
+#  {"ts": 1516000000.123456, "event": "CASE_BEGIN", "server": "whois.nic.example", "case": "case-0"}
+#  {"ts": 1516000000.123456, "event": "CASE_END", "server": "whois.nic.example", "case": "case-0",
+#   "value": {"n": 10, "p50": 0.0412, "p90": 0.0534, "p99": 0.0534}}
+#  {"ts": 1516000000.123456, "event": "ActiveTestThreads", "value": 12}
+#
+# latency is the whole query, connect the TCP connection and response the wait for the first byte
+# of response, connect and response are null when the query did not get that far
+# stopped is true when the rest of the response was not read as it could not change the verdict
+#
+# The text view is the original res_ format
+#  01/15/13:37:00.123456 PASS whois.nic.example foo.example case-0.3
+#  01/15/13:37:00.123456 RETRY_AFTER:60 https://rdap.nic.example/ case-0
+
+import json
+import time
+import queue
+import datetime
+import argparse
+import threading
+
+BATCH_LINES = 512 # Write when this many records are queued
+FLUSH_INTERVAL = 1.0 # Write when the oldest queued record is this many seconds old
+TEXT_TS_FORMAT = "%m/%d/%H:%M:%S.%f"
+
+_CLOSE = object()
+
+
+# Returns record dict as a line of the text view
+# Events keep a number value as event:value and always have fewer tokens than results
+def textLine(rec):
+  ts = datetime.datetime.fromtimestamp(rec['ts']).strftime(TEXT_TS_FORMAT)
+  if 'event' in rec:
+    name = rec['event']
+    if isinstance(rec.get('value'), (int, float)):
+      name += ":" + str(rec['value'])
+    if 'server' in rec:
+      return ts + " " + name + " " + rec['server'] + " " + rec['case']
+    return ts + " " + name
+  return ts + " " + rec['verdict'] + " " + rec['server'] + " " + rec['domain'] + " " + rec['case'] + "." + str(rec['rep'])
+
+
+# Returns record dict as a JSON line
+def jsonLine(rec):
+  return json.dumps(rec, separators=(',', ':'))
+
+
+# Returns result record of one query, latency, connect and response in seconds, ip = address queried
+# stopped = True if reading the response ended once its verdict was certain, see classify.StreamMatcher
+def resultRec(verdict, server, domain, case, rep, latency, ip, connect=None, response=None, stopped=False):
+  return {'ts': time.time(), 'verdict': verdict, 'server': server, 'domain': domain,
+            'case': case, 'rep': rep, 'latency': round(latency, 6), 'ip': ip,
+            'connect': None if connect is None else round(connect, 6),
+            'response': None if response is None else round(response, 6), 'stopped': stopped}
+
+
+# Returns status or case boundary event record, value is optional for case boundaries
+def eventRec(name, server=None, case=None, value=None):
+  rec = {'ts': time.time(), 'event': name}
+  if server is not None:
+    rec['server'] = server
+    rec['case'] = case
+  if value is not None:
+    rec['value'] = value
+  return rec
+
+
+class ResWriter(threading.Thread):
+  # fname = output file
+  # fmt = 'json' or 'text'
+  def __init__(self, fname, fmt='json', mode='w', batchLines=BATCH_LINES, flushInterval=FLUSH_INTERVAL):
+    self.f = open(fname, mode)
+    self.fmt = textLine if fmt == 'text' else jsonLine
+    self.batchLines = batchLines
+    self.flushInterval = flushInterval
+    self.q = queue.Queue()
+    threading.Thread.__init__(self, name=type(self).__name__, daemon=True)
+    self.start()
+
+
+  # Queue result of one query, see resultRec()
+  def result(self, verdict, server, domain, case, rep, latency, ip, connect=None, response=None, stopped=False):
+    self.q.put(resultRec(verdict, server, domain, case, rep, latency, ip, connect, response, stopped))
+
+
+  # Queue a status or case boundary event, see eventRec()
+  def event(self, name, server=None, case=None, value=None):
+    self.q.put(eventRec(name, server, case, value))
+
+
+  # Queue a record built elsewhere, e.g. received from a worker, see fleet.py
+  def record(self, rec):
+    self.q.put(rec)
+
+
+  # Records queued but not yet written
+  def depth(self):
+    return self.q.qsize()
+
+
+  def write(self, batch):
+    self.f.write(''.join(batch))
+    self.f.flush()
+
+
+  def run(self):
+    batch = []
+    deadline = None
+    while True:
+      try:
+        if batch:
+          rec = self.q.get(timeout=max(0, deadline - time.monotonic()))
+        else:
+          rec = self.q.get()
+      except queue.Empty:
+        rec = None
+
+      if rec is _CLOSE:
+        self.write(batch)
+        return
+
+      if rec is not None:
+        if not batch:
+          deadline = time.monotonic() + self.flushInterval
+        batch.append(self.fmt(rec) + '\n')
+
+      if len(batch) >= self.batchLines or (batch and time.monotonic() >= deadline):
+        self.write(batch)
+        batch = []
+
+
+  # Write everything queued and close the file
+  def close(self):
+    self.q.put(_CLOSE)
+    self.join()
+    self.f.close()
+
+
+# Yields record dicts from a results file in either format
+# Text lines are returned as {'text': line}
+def records(f):
+  for line in f:
+    line = line.rstrip('\n')
+    if len(line) == 0:
+      continue
+    if line[0] == '{':
+      yield json.loads(line)
+    else:
+      yield {'text': line}
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Print JSON Lines results files in the text res_ format')
+  ap.add_argument(nargs='+', metavar='file', dest='infile', type=argparse.FileType('r'), help='Results file')
+  args = ap.parse_args()
+
+  for f in args.infile:
+    for rec in records(f):
+      if 'text' in rec:
+        print(rec['text'])
+      else:
+        print(textLine(rec))
@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 #  The file is part of the WRL Project.
 #
@@ -19,87 +19,191 @@
 
 import os
 import sys
+import gzip
+import json
+import mmap
+import heapq
 import random
+import hashlib
+import argparse
+import collections
+import concurrent.futures
 import dns.resolver
 
 numTestDomains = 100
 numTopTLDs = 100
+numWorkers = os.cpu_count() # Zone files scanned in parallel
 ignoreDomains = ['com', 'net', 'jobs', 'cat', 'mil', 'edu', 'gov', 'int', 'arpa']
 serverZone = '.ws.sp.am' # DNS Zone containing CNAME records pointing to whois FQDNs
+indexFile = 'zonefiles.idx.json' # Per zone file results, reused while the file is unchanged
 
 def dbg(s):
-#  print s
+#  print(s)
   pass
 
-random.seed()
-zFiles = os.listdir('zonefiles/')
 
-#dbgFiles = 10 # How many files to read while developing this, remove when finished coding
-tlds = []
-for zf in zFiles:
-#  if len(tlds) >= dbgFiles: # For developing, remove when finished coding
-#    break
-
-  dbg(zf)
-  tld = {}
-  if zf.find(".txt") == -1:
-    dbg("This should not happen")
-    continue
-
-  zfh = open('zonefiles/' + zf, 'r')
-  lines = zfh.read().splitlines()
-  zfh.close()
-
-  dbg("after file read")
-
-  tld['name'] = lines[0].split(".")[0].strip()
-  if tld['name'] in ignoreDomains:
-    dbg("Ignoring:" + tld['name'])
-    continue
-
-  dbg("after name split")
-
-  rrs = []
-  for line in lines:
-    rr = line.split("\t")
-    rrs.append(rr)
-
-  dbg("after rr split")
-
-  ns = []
-  for rr in rrs:
-    if rr[3].lower() == 'ns':
-      ns.append(rr[0].split(".")[0])
-
-  dbg("after counting NS records")
-
-  if len(ns) < numTestDomains:
-    continue
+# Yields lines of a zone file as bytes without reading it all into memory
+# Gzipped files are decompressed as a stream, others are memory mapped
+def zoneLines(path):
+  if path.endswith('.gz'):
+    with gzip.open(path, 'rb') as f:
+      for line in f:
+        yield line
   else:
-    tld['size'] = len(ns)
-
-  tld['domains'] = random.sample(ns, numTestDomains)
-  for d in tld['domains']:
-    dbg(d + "." + tld['name'])
-
-  dbg(tld['name'] + ": " + str(tld['size']))
-  tlds.append(tld)
-
-tlds.sort(key=lambda tld: tld['size'], reverse=True)
-
-for ii in xrange(numTopTLDs):
-  # Find FQDN of whois server 
-  d = dns.resolver.Resolver()
-  try:
-    resp = d.query(tlds[ii]['name'] + serverZone, 'CNAME')
-    if len(resp.rrset) < 1:
+    with open(path, 'rb') as f:
+      if os.fstat(f.fileno()).st_size == 0:
+        return
+      mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      for line in iter(mm.readline, b''):
+        yield line
+      mm.close()
+
+
+# Returns hex content hash of file
+def fileHash(path):
+  h = hashlib.blake2b(digest_size=16)
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1048576), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
+
+# Scan one zone file in a single pass
+# Counts distinct second level NS owners and samples numTestDomains of them using rng
+# Each SLD is hashed with a key drawn from rng, the sample is the SLDs with the smallest hashes (bottom-k)
+# so an SLD is in it at most once however often and wherever it appears in the zone
+# Distinct SLDs are counted as changes of SLD from one NS owner to the next, zone files are sorted by owner
+# so the names under an SLD are together, only the sample is kept in memory
+# Returns dict with name, size and domains, size is None if the TLD is ignored
+def scanZone(path, rng):
+  dbg(path)
+  tld = {'name': None, 'size': None, 'domains': []}
+  key = rng.getrandbits(64).to_bytes(8, 'little')
+  sample = [] # Max-heap of (-hash, sld) of the smallest hashes seen
+  inSample = set() # Hashes in sample
+  prev = None
+  size = 0
+  for line in zoneLines(path):
+    rr = line.split(b'\t', 4)
+    if tld['name'] is None:
+      tld['name'] = rr[0].split(b'.')[0].strip().decode('ascii', 'replace')
+      if tld['name'] in ignoreDomains:
+        dbg("Ignoring:" + tld['name'])
+        return tld
+
+    if len(rr) < 4 or rr[3].lower() != b'ns':
+      continue
+    labels = rr[0].rstrip(b'.').split(b'.')
+    if len(labels) < 2 or labels[-2].lower() == prev:
+      continue
+    prev = labels[-2].lower()
+    size += 1
+
+    sld = prev.decode('ascii', 'replace')
+    h = int.from_bytes(hashlib.blake2b(prev, digest_size=8, key=key).digest(), 'little')
+    if h in inSample:
+      continue
+    if len(sample) < numTestDomains:
+      heapq.heappush(sample, (-h, sld))
+      inSample.add(h)
+    elif h < -sample[0][0]:
+      inSample.discard(-heapq.heapreplace(sample, (-h, sld))[0])
+      inSample.add(h)
+
+  dbg("after counting NS owners")
+  tld['size'] = size
+  tld['domains'] = sorted(sld for h, sld in sample)
+  dbg(str(tld['name']) + ": " + str(tld['size']))
+  return tld
+
+
+# Build index entry for a new or changed zone file
+# old = previous entry for path or None, reused if the content hash is unchanged
+# The sample is seeded from the content hash so unchanged zones always give the same domains
+def indexZone(path, old):
+  st = os.stat(path)
+  digest = fileHash(path)
+  if old and old['hash'] == digest and old['sampleSize'] == numTestDomains:
+    entry = dict(old)
+  else:
+    entry = scanZone(path, random.Random(digest))
+    entry['hash'] = digest
+    entry['sampleSize'] = numTestDomains
+  entry['bytes'] = st.st_size
+  entry['mtime'] = st.st_mtime_ns
+  return entry
+
+
+# Returns index of path to entry, empty if there is none
+def loadIndex(fname):
+  if not os.path.exists(fname):
+    return {}
+  with open(fname, 'r') as f:
+    return json.load(f)
+
+
+# Write index atomically, entries sorted by size so the largest come first
+def saveIndex(fname, index):
+  entries = sorted(index.items(), key=lambda kv: kv[1]['size'] or 0, reverse=True)
+  with open(fname + '.tmp', 'w') as f:
+    json.dump(collections.OrderedDict(entries), f)
+  os.replace(fname + '.tmp', fname)
+
+
+# Returns the n largest usable zones in index without sorting all of them
+def topZones(index, n):
+  usable = [e for e in index.values() if e['size'] is not None and e['size'] >= numTestDomains]
+  return heapq.nlargest(n, usable, key=lambda e: e['size'])
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Sample domains from the largest thick registry zone files')
+  ap.add_argument('-i', '--index', dest='index', type=str, default=indexFile, help='Zone index file')
+  ap.add_argument('-r', '--rescan', action='store_true', dest='rescan', help='Rescan every zone file')
+  ap.add_argument('-q', '--query', action='store_true', dest='query',
+                    help='Print name,size of the top zones from the index without scanning or DNS lookups')
+  args = ap.parse_args()
+
+  index = loadIndex(args.index)
+  if args.query:
+    for tld in topZones(index, numTopTLDs):
+      print(tld['name'] + ',' + str(tld['size']))
+    sys.exit(0)
+
+  # Only new or changed zone files are scanned
+  zFiles = ['zonefiles/' + zf for zf in os.listdir('zonefiles/') if zf.find('.txt') != -1]
+  changed = []
+  for path in zFiles:
+    st = os.stat(path)
+    old = index.get(path)
+    if args.rescan or not old or old['bytes'] != st.st_size or old['mtime'] != st.st_mtime_ns or \
+         old['sampleSize'] != numTestDomains:
+      changed.append(path)
+  dbg("changed:" + str(len(changed)) + " of " + str(len(zFiles)))
+
+  with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers) as pool:
+    olds = [None if args.rescan else index.get(path) for path in changed]
+    for path, entry in zip(changed, pool.map(indexZone, changed, olds)):
+      index[path] = entry
+
+  for path in list(index):
+    if path not in zFiles:
+      del index[path]
+  saveIndex(args.index, index)
+
+  for tld in topZones(index, numTopTLDs):
+    # Find FQDN of whois server
+    d = dns.resolver.Resolver()
+    try:
+      resp = d.query(tld['name'] + serverZone, 'CNAME')
+      if len(resp.rrset) < 1:
+        whois = 'UNKNOWN'
+      else:
+        whois = str(resp.rrset[0]).strip('.')
+    except:
       whois = 'UNKNOWN'
-    else:
-      whois = str(resp.rrset[0]).strip('.')
-  except:
-    whois = 'UNKNOWN'
-
-  s = whois + ','
-  for dom in tlds[ii]['domains']:
-    s += dom + '.' + tlds[ii]['name'] + ','
-  print s.strip(',')
+
+    s = whois + ','
+    for dom in tld['domains']:
+      s += dom + '.' + tld['name'] + ','
+    print(s.strip(','))
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 #  The file is part of the WRL Project.
 #
@@ -18,42 +18,29 @@
 #  Copyright (C) 2017, Andrew McConachie, <andrew.mcconachie@icann.org>
 
 import os
+import sys
 import json
-import urllib2
+import argparse
+import concurrent.futures
 from bs4 import BeautifulSoup
+import httpPool
 
-numRegs = 10
+numRegs = 10 # 0 for every registrar
 numDomains = 60
+numFetchers = 16 # Concurrent page downloads
+numParsers = os.cpu_count() # Parallel page parsers
 
 # Returns string between passed strings
 def between(s, s1, s2):
   return s.split(s1)[1].split(s2)[0].strip()
 
-cfgFile = open("config.json", "r")
-cfg = json.load(cfgFile)
-cfgFile.close()
 
-sFile = open(cfg['data_file'], 'r')
-soup = BeautifulSoup(sFile.read(), 'html.parser')
-sFile.close()
-
-details = []
-ii = 0
-for ll in soup.find_all('a'):
-  if ll['href'].count('wsa/wsa_details_clean') == 0:
-    continue
-
-  ii += 1
-  details.append(ll)
-  if ii == numRegs:
-    break
-
-regs = []
-for det in details:
+# Parse a registrar detail page, runs in a worker process
+def parseDetail(href, page):
   reg = {}
-  reg['id'] = between(det['href'], 'wsa_details_clean/', '.html')
-  soup = BeautifulSoup(urllib2.urlopen(cfg['url_base'] + det['href']).read(), 'html.parser')
-  
+  reg['id'] = between(href, 'wsa_details_clean/', '.html')
+  soup = BeautifulSoup(page, 'html.parser')
+
   pre = soup.find('pre')
   reg['date'] = between(pre.text, "\nDate:", "\n").strip()
   reg['name'] = between(pre.text, "\nIANAID,name:", "\n").split(reg['id'])[1].strip()
@@ -63,27 +50,74 @@ for det in details:
 
   reg['domains'] = []
   for ll in soup.find_all('a'):
-    if hasattr(ll, 'href'):
-      if ll['href'].count('/cgi/whois?d=') == 1:
-        reg['domains'].append(ll['href'].split('whois?d=')[1])
-  regs.append(reg)
-
-
-# Just for debugging
-#for reg in regs:
-#  print "\n"
-#  print "IANA ID:" + reg['id']
-#  print "date:" + reg['date']
-#  print "name:" + reg['name']
-#  print "whois_fqdn:" + reg['whois_fqdn']
-#  print "whois_ip:" + reg['whois_ip']
-#  print "\nDOMAINS:"
-#  for dom in reg['domains']:
-#    print dom
-
-# CSV = whois_fqdn, domain[0], domain[1], ...
-for reg in regs:
-  s = reg['whois_fqdn'] + ','
-  for ii in xrange(min(len(reg['domains']), numDomains)):
-    s += reg['domains'][ii] + ','
-  print s.strip(',')
+    if ll.get('href') and ll['href'].count('/cgi/whois?d=') == 1:
+      reg['domains'].append(ll['href'].split('whois?d=')[1])
+  return reg
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Sample domains of thin registry registrars')
+  ap.add_argument('-n', '--num-regs', dest='numRegs', type=int, default=numRegs, help='Registrars to fetch, 0 for all')
+  ap.add_argument('-c', '--config', dest='config', type=str, default='config.json', help='Config file')
+  args = ap.parse_args()
+
+  cfgFile = open(args.config, "r")
+  cfg = json.load(cfgFile)
+  cfgFile.close()
+
+  sFile = open(cfg['data_file'], 'r')
+  soup = BeautifulSoup(sFile.read(), 'html.parser')
+  sFile.close()
+
+  details = []
+  for ll in soup.find_all('a'):
+    if ll.get('href', '').count('wsa/wsa_details_clean') == 0:
+      continue
+
+    details.append(ll['href'])
+    if len(details) == args.numRegs:
+      break
+
+  # Pages download concurrently over pooled keep-alive connections through the disk cache
+  # and each one is handed to the parser pool as soon as it arrives
+  cache = httpPool.HttpCache(httpPool.HttpPool(), cfg.get('cache_dir', 'httpcache'))
+  regs = [None] * len(details)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=numFetchers) as fetchers, \
+         concurrent.futures.ProcessPoolExecutor(max_workers=numParsers) as parsers:
+    fetches = dict((fetchers.submit(cache.get, cfg['url_base'] + href), ii) for ii, href in enumerate(details))
+    parses = {}
+    for fut in concurrent.futures.as_completed(fetches):
+      ii = fetches[fut]
+      try:
+        parses[parsers.submit(parseDetail, details[ii], fut.result())] = ii
+      except Exception as e:
+        print("Fetch failed " + details[ii] + " " + str(e), file=sys.stderr)
+
+    for fut in concurrent.futures.as_completed(parses):
+      try:
+        regs[parses[fut]] = fut.result()
+      except Exception as e:
+        print("Parse failed " + details[parses[fut]] + " " + str(e), file=sys.stderr)
+  cache.pool.close()
+
+
+  # Just for debugging
+  #for reg in regs:
+  #  print("\n")
+  #  print("IANA ID:" + reg['id'])
+  #  print("date:" + reg['date'])
+  #  print("name:" + reg['name'])
+  #  print("whois_fqdn:" + reg['whois_fqdn'])
+  #  print("whois_ip:" + reg['whois_ip'])
+  #  print("\nDOMAINS:")
+  #  for dom in reg['domains']:
+  #    print(dom)
+
+  # CSV = whois_fqdn, domain[0], domain[1], ...
+  for reg in regs:
+    if reg is None:
+      continue
+    s = reg['whois_fqdn'] + ','
+    for ii in range(min(len(reg['domains']), numDomains)):
+      s += reg['domains'][ii] + ','
+    print(s.strip(','))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+import sys
+import time
+import asyncio
+
+
+#############
+# CONSTANTS #
+#############
+
+PORT = 43 # RFC 3912
+CONNECT_TIMEOUT = 5 # Seconds to wait for TCP connection
+READ_TIMEOUT = 5 # Seconds to wait for each chunk of the response after the first, TOTAL_TIMEOUT alone waits for that
+TOTAL_TIMEOUT = 10 # Seconds to wait for the whole query
+MAX_BYTES = 65536 # Stop reading responses after this many bytes
+CHUNK_SIZE = 4096
+ENCODINGS = ['utf-8', 'latin-1'] # Tried in order, latin-1 always succeeds
+
+
+###########
+# CLASSES #
+###########
+
+# Raised when any of our timeouts expire
+# stage = 'connect', 'read' or 'total'
+# output = decoded partial response
+class WhoisTimeout(Exception):
+  def __init__(self, stage, output):
+    self.stage = stage
+    self.output = output
+    Exception.__init__(self, stage + ' timeout')
+
+
+# Raised when the connection cannot be made or breaks
+# output = decoded partial response
+class WhoisError(Exception):
+  def __init__(self, msg, output):
+    self.output = output
+    Exception.__init__(self, msg)
+
+
+####################
+# GLOBAL FUNCTIONS #
+####################
+
+# Decode raw response bytes
+# A UTF-8 character cut in half at the end, by maxBytes or an early stop, is dropped
+def decode(raw):
+  for enc in ENCODINGS:
+    try:
+      return raw.decode(enc)
+    except UnicodeDecodeError as e:
+      if enc == 'utf-8' and e.reason == 'unexpected end of data':
+        return raw[:e.start].decode(enc)
+
+
+# Connect, send query and read until EOF, maxBytes or stop returns True
+# readTimeout applies between chunks, the first byte may take until the total timeout
+# Received bytes are appended to buf and timings set in timing so the caller keeps them on timeout
+#  timing['connect'] = seconds to establish the TCP connection
+#  timing['response'] = seconds from sending the query to the first byte of response
+#  timing['stopped'] = True if stop ended the read before EOF
+# stop = optional function called with each chunk, e.g. classify.StreamMatcher.feed
+async def _query(server, domain, port, connectTimeout, readTimeout, maxBytes, buf, timing, stop=None):
+  start = time.monotonic()
+  try:
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(server, port), connectTimeout)
+  except asyncio.TimeoutError:
+    raise WhoisTimeout('connect', '')
+  timing['connect'] = time.monotonic() - start
+
+  try:
+    writer.write(domain.encode('idna') + b'\r\n')
+    await writer.drain()
+    sent = time.monotonic()
+    while len(buf) < maxBytes:
+      try: # Servers may take the whole total timeout to answer, as with the whois binary
+        chunk = await asyncio.wait_for(reader.read(CHUNK_SIZE), readTimeout if 'response' in timing else None)
+      except asyncio.TimeoutError:
+        raise WhoisTimeout('read', decode(bytes(buf)))
+      if 'response' not in timing:
+        timing['response'] = time.monotonic() - sent
+      if not chunk:
+        break
+      buf.extend(chunk)
+      if stop and stop(chunk):
+        timing['stopped'] = True
+        break
+  finally:
+    writer.close()
+
+  return decode(bytes(buf[:maxBytes]))
+
+
+# Query whois server for domain
+# Returns decoded response, only the part read before stop returned True if given, see _query()
+# Raises WhoisTimeout or WhoisError
+# timing = optional dict that receives the connect and response timings, see _query()
+async def query(server, domain, port=PORT, connectTimeout=CONNECT_TIMEOUT, readTimeout=READ_TIMEOUT,
+                  totalTimeout=TOTAL_TIMEOUT, maxBytes=MAX_BYTES, timing=None, stop=None):
+  buf = bytearray()
+  if timing is None:
+    timing = {}
+  try:
+    return await asyncio.wait_for(_query(server, domain, port, connectTimeout, readTimeout, maxBytes, buf, timing,
+                                           stop), totalTimeout)
+  except asyncio.TimeoutError:
+    raise WhoisTimeout('total', decode(bytes(buf)))
+  except (OSError, UnicodeError) as e:
+    raise WhoisError(type(e).__name__ + ':' + str(e), decode(bytes(buf)))
+
+
+# Blocking wrapper around query() for callers without an event loop
+def whois(server, domain, **kwargs):
+  return asyncio.run(query(server, domain, **kwargs))
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 3:
+    print("whoisClient.py SERVER[:PORT] DOMAIN")
+    exit(0)
+
+  host, _, port = sys.argv[1].partition(':')
+  print(whois(host, sys.argv[2], port=int(port) if port else PORT))
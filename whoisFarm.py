@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Simulated farm of rate limited WHOIS servers for load testing wrl.py, see benchWrl.py
+#
+# Every endpoint is a whoisStub.StubServer on its own port of one event loop
+# Each endpoint gets a random profile from --seed
+#  limiter = token bucket, sliding window or none, kept per client address
+#  limit = queries/hour drawn log-uniform between --min-qh and --max-qh, so limits land across the TESTS cases
+#  latency = lognormal with median --latency and shape --sigma seconds
+#  banner = one of BANNERS, sent instead of a record once limited
+# --scale compresses time like wrl.py --speedup, limits are scaled up by it, latencies are not
+#
+# A subject CSV of the endpoints is written to --out, then 'ready' is printed on stdout
+
+import sys
+import math
+import time
+import random
+import asyncio
+import argparse
+import collections
+import resource
+import whoisStub
+
+BANNERS = [whoisStub.BANNER,
+           '%ERROR:201: access denied\r\n',
+           'WHOIS LIMIT EXCEEDED - SEE WWW.EXAMPLE/WHOIS\r\n',
+           'Number of allowed queries exceeded.\r\n',
+           ''] # Connection closed without an answer
+KINDS = ['bucket', 'window', 'none']
+DOMAINS = 2 # Domains on each subject line
+
+
+# Token bucket of burst tokens refilled at rate tokens/second
+class TokenBucket():
+  def __init__(self, rate, burst):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = float(burst)
+    self.last = time.monotonic()
+
+
+  # Returns True if a query at monotonic time now is allowed
+  def allow(self, now):
+    self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+    self.last = now
+    if self.tokens >= 1:
+      self.tokens -= 1
+      return True
+    return False
+
+
+# At most limit queries in any window seconds
+class SlidingWindow():
+  def __init__(self, limit, window):
+    self.limit = limit
+    self.window = window
+    self.times = collections.deque()
+
+
+  def allow(self, now):
+    while self.times and self.times[0] <= now - self.window:
+      self.times.popleft()
+    if len(self.times) < self.limit:
+      self.times.append(now)
+      return True
+    return False
+
+
+# One simulated WHOIS server
+# limiter = function returning a new limiter for each client address, None for unlimited
+# latency = (median, sigma) of response delay in seconds
+class FarmServer(whoisStub.StubServer):
+  def __init__(self, limiter, latency, banner):
+    whoisStub.StubServer.__init__(self)
+    self.limiter = limiter
+    self.latency = latency
+    self.banner = banner
+    self.clients = {} # Client address to limiter
+
+
+  def respond(self, domain, client):
+    self.queries += 1
+    if self.limiter:
+      if client not in self.clients:
+        self.clients[client] = self.limiter()
+      if not self.clients[client].allow(time.monotonic()):
+        return self.banner
+    return whoisStub.StubServer.respond(self, domain)
+
+
+  async def handle(self, reader, writer):
+    try:
+      line = await reader.readline()
+      domain = line.decode('utf-8', 'replace').strip().lower()
+      median, sigma = self.latency
+      if median:
+        await asyncio.sleep(random.lognormvariate(math.log(median), sigma))
+      writer.write(self.respond(domain, writer.get_extra_info('peername')[0]).encode('utf-8'))
+      await writer.drain()
+    except (OSError, asyncio.CancelledError):
+      pass
+    finally:
+      writer.close()
+
+
+# Returns list of (FarmServer, profile) for n endpoints
+# scale = time compression, see wrl.py --speedup
+def build(n, seed, scale=1, minQh=1, maxQh=480, latency=0.05, sigma=0.5, kinds=KINDS):
+  rnd = random.Random(seed)
+  rv = []
+  for ii in range(n):
+    kind = kinds[ii % len(kinds)]
+    qh = math.exp(rnd.uniform(math.log(minQh), math.log(maxQh)))
+    banner = rnd.choice(BANNERS)
+    if kind == 'bucket':
+      burst = rnd.randint(1, 5)
+      rate = qh * scale / 3600
+      limiter = lambda rate=rate, burst=burst: TokenBucket(rate, burst)
+    elif kind == 'window':
+      limit = max(1, int(qh))
+      window = 3600.0 / scale
+      limiter = lambda limit=limit, window=window: SlidingWindow(limit, window)
+    else:
+      limiter = None
+    profile = {'kind': kind, 'qh': None if kind == 'none' else round(qh, 2), 'banner': banner.strip()}
+    rv.append((FarmServer(limiter, (latency, sigma), banner), profile))
+  return rv
+
+
+# Raise the open file limit as far as allowed, every endpoint and connection needs one
+def raiseFileLimit():
+  soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  if soft < hard:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+  return hard
+
+
+async def serve(farm, host, port, out):
+  servers = []
+  with open(out, 'w') as f:
+    for ii, (stub, profile) in enumerate(farm):
+      servers.append(await stub.start(host, port + ii))
+      f.write(host + ':' + str(port + ii) + ',' + ','.join('d' + str(ii) + '-' + str(jj) + '.test'
+                                                         for jj in range(DOMAINS)) + '\n')
+  print("ready " + str(len(servers)), flush=True)
+  await asyncio.gather(*[srv.serve_forever() for srv in servers])
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Simulated farm of rate limited WHOIS servers')
+  ap.add_argument('-n', '--servers', dest='servers', type=int, default=1000, help='Number of endpoints')
+  ap.add_argument('-p', '--port', dest='port', type=int, default=20000, help='Port of the first endpoint')
+  ap.add_argument('-b', '--bind', dest='host', type=str, default='127.0.0.1', help='Address to listen on')
+  ap.add_argument('-o', '--out', dest='out', type=str, default='farm.csv', help='Subject CSV to write')
+  ap.add_argument('--seed', dest='seed', type=int, default=0, help='Seed of the endpoint profiles')
+  ap.add_argument('--scale', dest='scale', type=float, default=1, help='Time compression, see wrl.py --speedup')
+  ap.add_argument('--min-qh', dest='minQh', type=float, default=1, help='Lowest rate limit in queries/hour')
+  ap.add_argument('--max-qh', dest='maxQh', type=float, default=480, help='Highest rate limit in queries/hour')
+  ap.add_argument('--latency', dest='latency', type=float, default=0.05, help='Median response delay in seconds')
+  ap.add_argument('--sigma', dest='sigma', type=float, default=0.5, help='Lognormal shape of response delay')
+  ap.add_argument('--kinds', dest='kinds', type=str, default=','.join(KINDS),
+                    help='Limiters handed out in turn, of ' + ','.join(KINDS))
+  ap.add_argument('--profiles', dest='profiles', action='store_true', default=False,
+                    help='Print the profile of every endpoint and exit')
+  args = ap.parse_args()
+
+  kinds = args.kinds.split(',')
+  if any(k not in KINDS for k in kinds):
+    ap.error('unknown limiter kind')
+  farm = build(args.servers, args.seed, args.scale, args.minQh, args.maxQh, args.latency, args.sigma, kinds)
+  if args.profiles:
+    for ii, (stub, profile) in enumerate(farm):
+      print(args.host + ':' + str(args.port + ii) + ' ' + repr(profile))
+    sys.exit(0)
+
+  if raiseFileLimit() < args.servers + 1024:
+    print("Warning: open file limit is too low for " + str(args.servers) + " endpoints", file=sys.stderr)
+  try:
+    asyncio.run(serve(farm, args.host, args.port, args.out))
+  except KeyboardInterrupt:
+    pass
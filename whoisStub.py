@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+#  The file is part of the WRL Project.
+#
+#  The WRL Project is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  The WRL Project is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#  Copyright (C) 2018, Andrew McConachie, <andrew.mcconachie@icann.org>
+
+# Local stand-in WHOIS server for testing wrl.py without network
+# Domains listed in the subject CSV get a registry record, others get 'No match'
+# After --limit queries the server answers with a rate-limit banner instead
+
+import asyncio
+import argparse
+import datetime
+
+RECORD = """Domain Name: {domain}
+Registry Domain ID: 1234567_DOMAIN_STUB
+Registrar WHOIS Server: whois.example
+Updated Date: 2018-01-15T00:00:00Z
+Creation Date: 2001-01-15T00:00:00Z
+Registry Expiry Date: 2028-01-15T00:00:00Z
+Registrar: Stub Registrar
+>>> Last update of whois database: {now} <<<
+"""
+NOMATCH = 'No match for "{domain}".\r\n'
+BANNER = 'Query rate limit exceeded. Try again later.\r\n'
+
+
+# Answers whois queries, one instance per listening port
+# domains = set of registered domains, None to answer every domain
+# limit = queries answered before sending BANNER, 0 for unlimited
+# delay = seconds to wait before answering
+# hang = never answer, for timeout testing
+class StubServer():
+  def __init__(self, domains=None, limit=0, delay=0, hang=False):
+    self.domains = domains
+    self.limit = limit
+    self.delay = delay
+    self.hang = hang
+    self.queries = 0
+
+  # Returns response string for domain
+  def respond(self, domain):
+    self.queries += 1
+    if self.limit and self.queries > self.limit:
+      return BANNER
+    if self.domains is None or domain in self.domains:
+      return RECORD.format(domain=domain.upper(), now=datetime.datetime.utcnow().isoformat()).replace('\n', '\r\n')
+    return NOMATCH.format(domain=domain.upper())
+
+  async def handle(self, reader, writer):
+    try:
+      line = await reader.readline()
+      domain = line.decode('utf-8', 'replace').strip().lower()
+      if self.hang:
+        await asyncio.sleep(3600)
+      if self.delay:
+        await asyncio.sleep(self.delay)
+      writer.write(self.respond(domain).encode('utf-8'))
+      await writer.drain()
+    except (OSError, asyncio.CancelledError):
+      pass
+    finally:
+      writer.close()
+
+  # Returns listening asyncio.Server, port 0 picks a free port
+  async def start(self, host='127.0.0.1', port=0):
+    return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve(stub, host, port):
+  srv = await stub.start(host, port)
+  print("Listening on " + repr(srv.sockets[0].getsockname()))
+  async with srv:
+    await srv.serve_forever()
+
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser(description='Local stand-in WHOIS server')
+  ap.add_argument('-p', '--port', dest='port', type=int, default=4343, help='TCP port to listen on')
+  ap.add_argument('-b', '--bind', dest='host', type=str, default='127.0.0.1', help='Address to listen on')
+  ap.add_argument('-f', '--file', dest='subjects', type=str, default=None,
+                    help='Subject CSV, only its domains are registered')
+  ap.add_argument('-l', '--limit', dest='limit', type=int, default=0, help='Queries answered before rate limiting')
+  ap.add_argument('-d', '--delay', dest='delay', type=float, default=0, help='Seconds to wait before answering')
+  ap.add_argument('--hang', dest='hang', action='store_true', default=False, help='Never answer')
+  args = ap.parse_args()
+
+  domains = None
+  if args.subjects:
+    domains = set()
+    with open(args.subjects, 'r') as f:
+      for line in f.read().split('\n'):
+        if len(line) > 0:
+          domains.update(d.lower() for d in line.split(',')[1:])
+
+  try:
+    asyncio.run(serve(StubServer(domains, args.limit, args.delay, args.hang), args.host, args.port))
+  except KeyboardInterrupt:
+    pass
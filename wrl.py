@@ -19,12 +19,26 @@
 
 import os
 import sys
+import time
 import datetime
 import signal
-import dns.resolver
-import threading
-import subprocess
+import asyncio
+import heapq
+import concurrent.futures
+import math
 import random
+import argparse
+import whoisClient
+import rdapClient
+import httpPool
+import classify
+import dbgStore
+import resWriter
+import dnsCache
+import latHist
+import fleet
+import journal
+import metrics
 
 
 #############
@@ -32,19 +46,36 @@ import random
 #############
 
 DYING = False # Set to True when a kill signal has been received
+mainTask = None # Task running the coroutine given to runLoop()
+sched = None # Scheduler running all test queries
+resolver = None # DNS cache of whois server names and addresses
+rdapPool = None # Keep-alive HTTP connections of RDAP subject lines, see rdapClient.py
+rdapThreads = None # Executor running rdapPool requests
+jnl = None # Progress journal, see journal.py
+progress = {} # Subject line server to its progress for the journal, see runServer()
+stats = None # In-memory counters of queries, see metrics.py
+metricsAddr = None # (host, port) serving metrics, None for no endpoint
 TIMEOUT = 10 # How many seconds we wait for whois response before registering failure
-TEST_STRINGS = ['registry expiry date:', 'domain name:', 'creation date:', 'created date:'] # Strings we test for in registrant data
+CONNECT_TIMEOUT = 5 # How many seconds we wait for the TCP connection to whois server
+READ_TIMEOUT = 5 # How many seconds we wait between chunks of whois response
+MAX_RESPONSE = 65536 # Maximum bytes of whois response we read
+EARLY_STOP = False # Stop reading a whois response once its verdict is certain, see classify.StreamMatcher
+           # PASS bodies in the debug store are then cut short and replayDbg.py skips them
+WORKERS = 256 # Maximum whois queries in flight at once
+SERVER_WORKERS = 32 # Maximum queries in flight to one server, a hanging server can't hold every slot
+RDAP_THREADS = 64 # Maximum RDAP queries in flight at once, they block a thread each
+CASE_GAP = TIMEOUT # Cool-down seconds between a server's cases
+STATUS_INTERVAL = 600 # How often we log the number of active jobs
+PROFILE_FILE = 'indicators.json' # Per-TLD/per-server indicator profiles, see classify.py, used if present
 DEBUG_PREFIX = 'dbg_'
 RESULTS_PREFIX = 'res_'
-if os.uname().sysname.lower() == 'linux':
-  WHOIS_BINARY = '/bin/whois'
-elif os.uname().sysname.lower() == 'freebsd':
-  WHOIS_BINARY = '/usr/bin/whois'
+JOURNAL_PREFIX = 'jnl_'
+RESULTS_FORMAT = 'json' # 'json' for JSON Lines or 'text' for the original res_ format, see resWriter.py
 
 # 3 possible results for each test
-TEST_FAIL = 0
-TEST_PASS = 1
-TEST_NOMATCH = 2
+TEST_FAIL = classify.TEST_FAIL
+TEST_PASS = classify.TEST_PASS
+TEST_NOMATCH = classify.TEST_NOMATCH
 
 # Our test cases as ordered tuples of [test_case, delay, count]
 #TESTS = [['case-0',1,1], ['case-1',1800,12], ['case-2',900,12], ['case-3',15,240]] # Our old case set
@@ -85,20 +116,35 @@ TESTS = [['case-0', 3600, 10],   # 10 hours, 1q/h
                                  # Total queries == 4,900
                                  # Total time == 90 hours
 
+# Adaptive mode, see runAdaptive()
+# Each probe runs one case of TESTS for one LIMIT_WINDOW of its queries plus PROBE_FAILS more, enough for
+# the quota of a server limiting at that rate to run out and a SeqTest to see it fail
+# A probe stops early only once a SeqTest decides the server is limiting us
+# Probes are LIMIT_WINDOW apart so the quota left over from one probe cannot help the next
+# Slow cases get short probes, case-1 sends 6 queries in 3 hours, so a search takes 5 to 12 hours where
+# running every case takes 90. The cost is evidence: a server that fails only now and then once limited,
+# or whose limit is counted over more than LIMIT_WINDOW, can pass a probe a full case would have failed
+LIMIT_WINDOW = 3600 # Seconds of the longest rate limit window we expect, limits are quoted per hour
+FAIL_BASE = 0.05 # Fail rate of a server that is not rate limiting us
+FAIL_LIMITED = 0.5 # Fail rate of a server that is rate limiting us
+LIMITED_LLR = 8.0 # Log likelihood ratio deciding limited, about 4 fails in a row at FAIL_BASE
+PROBE_FAILS = math.ceil(LIMITED_LLR / math.log(FAIL_LIMITED / FAIL_BASE)) # Fails in a row deciding limited
+
 
 ###########
 # CLASSES #
 ###########
 
-# Testing thread
-# server = whois server FQDN
+# One test case against one whois server, run by the Scheduler
+# server = whois server FQDN, or RDAP base URL
 # domains = list of domains to test
 # case = name of test case
 # delay = delay between tests in seconds
 # cnt = count of tests
-class WrlThr(threading.Thread):
+class WrlJob():
   def __init__(self, server, domains, case, delay, cnt):
-    self.server = self.canonicalServer(server)
+    self.rdap = rdapClient.isRdap(server)
+    self.server = server if self.rdap else resolver.canonical(server)
     self.tld = server.split('.')[-1]
     self.desc = self.server + '_' + case
     self.domains = domains
@@ -106,197 +152,629 @@ class WrlThr(threading.Thread):
     self.case = case
     self.delay = delay
     self.cnt = cnt
-    self.reps = 0
-
-    #out("Starting thread " + type(self).__name__ + '_' + self.desc)
-    threading.Thread.__init__(self, name=type(self).__name__ + '_' + self.desc)
-
-
-  def run(self):
-    domain = self.domains[self.reps % len(self.domains)]
-    logStr = self.server + " " + domain + " " + self.case + "." + str(self.reps)
+    self.start = None # Loop time of rep 0, set by Scheduler
+    self.left = cnt + 1 # Queries plus closing tick not yet completed
+    self.done = None # Event set by Scheduler when job has finished
+    self.hist = latHist.LatHist() # Latency of every query
+    self.seqTest = None # SeqTest deciding when to stop early, adaptive mode only
+    self.stopped = False # No more reps are scheduled once set
+    self.next = 0 # Next rep to send, set by Scheduler
+    self.due = None # Loop time next rep is due, set by Scheduler
+
+
+  # Run query number rep
+  async def run(self, rep):
+    domain = self.domains[rep % len(self.domains)]
+    addrs = None if self.rdap else resolver.addrs(self.server)
+    addr = rdapClient.host(self.server) if self.rdap else addrs[0]
+    timing = {'start': time.monotonic()}
 
     try:
-       res = test(whois(self.server, domain), self.server, domain)
+       if self.rdap:
+         status, headers, body = await rdap(self.server, domain, timing)
+         res = testRdap(status, headers, body, self.server, domain, self.case, rep)
+       else:
+         rs = await whois(self.server, addrs, domain, timing)
+         res = test(rs, self.server, domain, self.case, rep, timing.get('stopped', False))
        if res == TEST_PASS:
-         out("PASS " + logStr)
+         self.out("PASS", domain, rep, addr, timing)
        elif res == TEST_NOMATCH:
-         out("NOMA " + logStr)
+         self.out("NOMA", domain, rep, addr, timing)
        elif res == TEST_FAIL:
-         out("FAIL " + logStr)
-
-    except subprocess.TimeoutExpired as e:
-      out("FAIL_timeout " + logStr)
-      dbg(">whois -h " + self.server + " " + domain + " FAIL_timeout\nstdout:" + str(e.output))
-    except subprocess.CalledProcessError as e:
-      out("FAIL_whois_cmd " + logStr)
-      dbg(">whois -h " + self.server + " " + domain + " FAIL_whois_cmd\nchild_exit_status:" + str(e.returncode) + " " + str(e.output))
-    except:
-      out("FAIL_general_child_exception " + logStr)
-      dbg(">whois -h " + self.server + " " + domain + " FAIL_general_child_exception")
+         self.out("FAIL", domain, rep, addr, timing)
+
+    except whoisClient.WhoisTimeout as e:
+      stats.timeout(e.stage)
+      self.out("FAIL_timeout", domain, rep, addr, timing)
+      dbg(self.server, domain, self.case, rep, "FAIL_timeout", e.stage + " stdout:" + e.output)
+    except whoisClient.WhoisError as e:
+      self.out("FAIL_whois_cmd", domain, rep, addr, timing)
+      dbg(self.server, domain, self.case, rep, "FAIL_whois_cmd", "error:" + str(e) + " " + e.output)
+    except asyncio.CancelledError:
       raise
-    finally:
-      self.reps += 1
-      if self.reps < self.cnt:
-        t = threading.Timer(self.delay, self.run)
-        t.name = type(t).__name__ + "_" + self.desc
-        t.start()
-      elif self.reps == self.cnt:
-        t = threading.Timer(self.delay, lambda:None)
-        t.name = type(t).__name__ + "_" + self.desc
-        t.start()
-
-
-  # Discover canonical name of whois server
-  def canonicalServer(self, server):
-    d = dns.resolver.Resolver()
-    try:
-      resp = d.query(server, 'CNAME')
     except:
-      return server
+      self.out("FAIL_general_child_exception", domain, rep, addr, timing)
+      dbg(self.server, domain, self.case, rep, "FAIL_general_child_exception", None)
+      raise
 
-    if len(resp.rrset) < 1:
-      return server
-    else:
-      return str(resp.rrset[0]).strip('.')
+
+  # Record latency of query rep and queue its result
+  # timing = dict with the monotonic start time and the timings set by whoisClient.query() or rdapClient.query()
+  # addr = address queried, RDAP queries log the address their connection went to if they got one
+  def out(self, verdict, domain, rep, addr, timing):
+    addr = timing.get('addr', addr)
+    latency = time.monotonic() - timing['start']
+    self.hist.add(latency)
+    if self.seqTest and self.seqTest.update(verdict.startswith('FAIL')):
+      self.stopped = True
+    stats.complete(self.server, self.case, verdict)
+    out(verdict, self.server, domain, self.case, rep, latency, addr, timing.get('connect'), timing.get('response'),
+          timing.get('stopped', False))
+
+
+# Sequential test for a fail rate rising from FAIL_BASE to FAIL_LIMITED, a CUSUM of the log likelihood ratio
+# A server passes until its quota is used up and fails from then on, so the ratio is kept from going
+# below 0 and passes before the limit hits cannot outweigh the fails after it
+# Only limited is ever decided, a server is not limited if the probe ends undecided
+class SeqTest():
+  def __init__(self):
+    self.llr = 0.0 # Log likelihood ratio of limited against not limited since the last run of passes
+    self.decision = None
+    self.queries = 0
+
+
+  # Add outcome of one query
+  # Returns True once decided limited, None while undecided
+  def update(self, failed):
+    if self.decision is None:
+      self.queries += 1
+      if failed:
+        self.llr += math.log(FAIL_LIMITED / FAIL_BASE)
+      else:
+        self.llr = max(0.0, self.llr + math.log((1 - FAIL_LIMITED) / (1 - FAIL_BASE)))
+      if self.llr >= LIMITED_LLR:
+        self.decision = True
+    return self.decision
+
+
+  def limited(self):
+    return bool(self.decision)
+
+
+# Runs every (server, case, rep) from one event loop
+# Due queries are kept in a heap of (due, seq, job, rep), only the next rep of each job is queued
+# Due times are offsets from the job start so slow queries never push later reps back
+# At most workers queries are in flight and serverWorkers to one server, further due queries wait for
+# a free slot in their own task, so the heap loop never blocks and other servers' queries go out when due
+# A job finishes with a closing tick one delay after its last query, like the old trailing Timer
+# A stopped job schedules no more queries, its next entry becomes the closing tick
+class Scheduler():
+  def __init__(self, workers, serverWorkers=SERVER_WORKERS):
+    self.heap = []
+    self.seq = 0
+    self.wake = asyncio.Event()
+    self.workers = asyncio.Semaphore(workers)
+    self.serverWorkers = serverWorkers
+    self.servers = {} # Server to its Semaphore of serverWorkers slots
+    self.tasks = set()
+    self.active = 0 # Jobs not yet finished
+    self.left = {} # Unfinished jobs per case
+
+
+  # Queue rep of job at loop time due
+  def push(self, due, job, rep):
+    job.next = rep
+    job.due = due
+    heapq.heappush(self.heap, (due, self.seq, job, rep))
+    self.seq += 1
+    self.wake.set()
+
+
+  # Start job now, or at wall clock time due if given
+  # Queries before rep are skipped, they were sent before a resume
+  # Returns an Event that is set once job has finished
+  def startJob(self, job, rep=0, due=None):
+    self.left[job.case] = self.left.get(job.case, 0) + 1
+    self.active += 1
+
+    at = asyncio.get_running_loop().time()
+    if due is not None:
+      at += max(0, due - time.time())
+    job.start = at - rep * job.delay
+    job.left -= rep
+    job.done = asyncio.Event()
+    self.push(at, job, rep)
+    return job.done
+
+
+  # Count one completed query or the closing tick of job
+  def complete(self, job):
+    job.left -= 1
+    if job.left == 0:
+      self.active -= 1
+      self.left[job.case] -= 1
+      if self.left[job.case] == 0:
+        del self.left[job.case]
+      job.done.set()
+
+
+  # Run rep of job due at loop time due once a slot of its server and a worker slot are free
+  async def dispatch(self, job, rep, due):
+    if job.server not in self.servers:
+      self.servers[job.server] = asyncio.Semaphore(self.serverWorkers)
+    try:
+      async with self.servers[job.server], self.workers:
+        stats.issue(job.server, job.case, asyncio.get_running_loop().time() - due)
+        await job.run(rep)
+    finally:
+      self.complete(job)
+
+
+  # Main loop, pops due entries off the heap forever
+  async def run(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      if not self.heap:
+        self.wake.clear()
+        await self.wake.wait()
+        continue
+
+      due = self.heap[0][0]
+      if due > loop.time():
+        self.wake.clear()
+        timer = loop.call_at(due, self.wake.set)
+        await self.wake.wait()
+        timer.cancel()
+        continue
+
+      due, _, job, rep = heapq.heappop(self.heap)
+      if job.stopped:
+        job.left -= job.cnt - rep # Reps never run
+        self.complete(job)
+      elif rep < job.cnt:
+        self.push(job.start + (rep + 1) * job.delay, job, rep + 1)
+        task = asyncio.ensure_future(self.dispatch(job, rep, due))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+      else:
+        self.complete(job)
 
 
 ####################
 # GLOBAL FUNCTIONS #
 ####################
 
-# Call whois binary and returns output
-def whois(server, domain):
-  s = WHOIS_BINARY + ' -h ' + server + ' ' + domain
-  return str(subprocess.check_output(s.split(), timeout=TIMEOUT, stderr=subprocess.STDOUT))
-#  return "Test String Registry Expiry Date:"
+# Query whois server on port 43 and return decoded output
+# addrs = addresses of server, the next is tried only if connecting to one fails, like the whois binary did
+# server may be given as host:port for testing against whoisStub.py
+# timing = dict receiving connect and response timings, see whoisClient.py, and 'addr', the address last tried
+# With EARLY_STOP only the part of the response read until its verdict was certain is returned and kept
+async def whois(server, addrs, domain, timing):
+  port = server.partition(':')[2]
+  for ii, addr in enumerate(addrs):
+    timing['addr'] = addr
+    stop = classifier.matcher(server, domain).stream(domain).feed if EARLY_STOP else None
+    try:
+      return await whoisClient.query(addr, domain, port=int(port) if port else whoisClient.PORT,
+                                       connectTimeout=CONNECT_TIMEOUT, readTimeout=READ_TIMEOUT,
+                                       totalTimeout=TIMEOUT, maxBytes=MAX_RESPONSE, timing=timing, stop=stop)
+    except (whoisClient.WhoisTimeout, whoisClient.WhoisError):
+      if 'connect' in timing: # Connected, the server itself failed
+        raise
+      resolver.failed(server, addr)
+      if ii == len(addrs) - 1:
+        raise
+
+
+# Look up domain at RDAP base URL base over the shared keep-alive pool
+# Returns (status, headers, body), see rdapClient.py
+async def rdap(base, domain, timing=None):
+  return await rdapClient.query(rdapPool, base, domain, rdapThreads, totalTimeout=TIMEOUT, timing=timing)
+
+
+# Queue result of one query for the results writer
+# addr = IP address that was queried
+# latency, connect and response in seconds, connect and response are None if not reached
+# stopped = True if the response was read only until its verdict was certain
+def out(verdict, server, domain, case, rep, latency, addr, connect=None, response=None, stopped=False):
+  if DYING:
+    return
 
+  rf.result(verdict, server, domain, case, rep, latency, addr, connect, response, stopped)
 
-# Output a timestamped string
-def out(s):
+
+# Queue a status or case boundary event for the results writer
+def event(name, server=None, case=None, value=None):
   if DYING:
     return
 
-  dt = datetime.datetime.now()
-  ts = dt.strftime("%m/%d/%H:%M:%S.%f")
-  rf.write(ts + " " + str(s) + "\n")
+  rf.event(name, server, case, value)
 
 
-# Dump debugging info to file
-def dbg(s):
+# Store response of one query in the debug store, see dbgStore.py
+# body may be None when there is no response to keep, stopped = True if body was cut short, see out()
+def dbg(server, domain, case, rep, verdict, body, stopped=False):
   if DYING:
     return
-  
-  df.write("\n\n" + str(s))
+
+  df.add(server, domain, case, rep, verdict, body, stopped=stopped)
 
 
 # Test if we are happy with returned results
-# Takes a received string, a whois server, and the domain under test, returns TEST_PASS, TEST_FAIL or TEST_NOMATCH
-def test(rs, server, domain):
-  if len(rs) > 0:
-    for ts in TEST_STRINGS:
-      if ts in rs.lower() and domain in rs.lower():
-        dbg(">whois -h " + server + " " + domain + " PASS_" + ts.replace(' ', '_').strip(':') + "\n" + rs)
-        return TEST_PASS
+# Takes a received string, a whois server, the domain under test, case, rep and whether rs was cut short
+# Returns TEST_PASS, TEST_FAIL or TEST_NOMATCH
+def test(rs, server, domain, case, rep, stopped=False):
+  res, ind = classifier.classify(rs, server, domain)
+  dbg(server, domain, case, rep, classify.dbgVerdict(res, ind), rs, stopped)
+  return res
+
+
+# Test an RDAP response like test()
+# A Retry-After header is logged as a RETRY_AFTER event with its seconds, queries keep to the schedule
+def testRdap(status, headers, body, server, domain, case, rep):
+  res, ind = classify.classifyRdap(status, body, domain)
+  dbg(server, domain, case, rep, classify.dbgVerdict(res, ind), rdapClient.dbgBody(status, headers, body))
+  wait = rdapClient.retryAfter(headers)
+  if wait is not None:
+    event("RETRY_AFTER", server, case, wait)
+  return res
+
+
+# Run through our test cases for one subject line
+# The next case starts CASE_GAP seconds after this server has finished the current one
+# caseDone = optional function called with the name of each finished case
+# resume = optional journal entry of this server to continue from, see journal.py
+async def runServer(cases, sub, caseDone=None, resume=None):
+  first, rep, due, domains = 0, 0, None, None
+  if resume:
+    if resume.get('done'):
+      progress[sub[0]] = {'done': True}
+      return
+    first, rep, due, domains = resume['case'], resume['rep'], resume['due'], resume['domains']
+  state = progress[sub[0]] = {'case': first, 'job': None, 'due': due or time.time()}
+
+  for ii, (case, delay, cnt) in enumerate(cases):
+    if ii < first:
+      continue
+    if DYING:
+      return
+    if ii > first:
+      state.update(case=ii, job=None, due=time.time() + CASE_GAP)
+      await asyncio.sleep(CASE_GAP)
+
+    job = WrlJob(sub[0], sub[1:], case, delay, cnt)
+    if ii == first and domains:
+      job.domains = domains
+    state['job'] = job
+    event("CASE_BEGIN", job.server, case)
+    if ii == first:
+      await sched.startJob(job, rep, due).wait()
+    else:
+      await sched.startJob(job).wait()
+    event("CASE_END", job.server, case, job.hist.percentiles())
+    if caseDone:
+      caseDone(case)
+  state['done'] = True
+
+
+# Returns progress of every server for the journal, see journal.py
+def snapshot():
+  now, wall = asyncio.get_running_loop().time(), time.time()
+  rv = {}
+  for server, state in progress.items():
+    if state.get('done'):
+      rv[server] = {'done': True}
+    elif state['job'] is None:
+      rv[server] = {'case': state['case'], 'rep': 0, 'domains': None, 'due': state['due']}
+    else:
+      job = state['job']
+      due = wall if job.due is None else wall + job.due - now
+      rv[server] = {'case': state['case'], 'rep': job.next, 'domains': job.domains, 'due': due}
+  return rv
+
+
+# Search for the lowest rate of cases at which one subject line's server rate limits us
+# Bisects over cases ordered by rising rate, each probe is a case cut short by a SeqTest
+# A probe covers one LIMIT_WINDOW plus PROBE_FAILS queries and waits out another window before the next
+# Logs the probes like runServer() does, then a CASE_THRESHOLD event naming the lowest limited case
+# or 'none', with the rate in queries/hour and the number of queries sent
+async def runAdaptive(cases, sub):
+  cases = sorted(cases, key=lambda c: c[1], reverse=True)
+  lo, hi = -1, len(cases) # Highest case known not limited, lowest case known limited
+  queries = 0
+  server = None
+  while hi - lo > 1:
+    if DYING:
+      return
+    if server:
+      await asyncio.sleep(max(CASE_GAP, LIMIT_WINDOW))
+
+    mid = (lo + hi) // 2
+    case, delay, cnt = cases[mid]
+    job = WrlJob(sub[0], sub[1:], case, delay, min(cnt, math.ceil(LIMIT_WINDOW / delay) + PROBE_FAILS))
+    job.seqTest = SeqTest()
+    server = job.server
+    event("CASE_BEGIN", job.server, case)
+    await sched.startJob(job).wait()
+    event("CASE_END", job.server, case, job.hist.percentiles())
+    queries += job.seqTest.queries
+
+    if job.seqTest.limited():
+      hi = mid
+    else:
+      lo = mid
 
-    if "no match" in rs.lower() and domain in rs.lower():
-      dbg(">whois -h " + server + " " + domain + " NOMA\n" + rs)
-      return TEST_NOMATCH
+  if hi == len(cases):
+    event("CASE_THRESHOLD", server, 'none', {'qh': None, 'queries': queries})
+  else:
+    event("CASE_THRESHOLD", server, cases[hi][0], {'qh': round(3600 / cases[hi][1], 2), 'queries': queries})
 
-    if "domain not found" in rs.lower():
-      dbg(">whois -h " + server + " " + domain + " NOMA\n" + rs)
-      return TEST_NOMATCH
 
-  dbg(">whois -h " + server + " " + domain + " FAIL\n" + rs)
-  return TEST_FAIL
+# Run through our test cases
+# Every server runs its own pipeline of cases, never more than one case at a time
+# Log active jobs every STATUS_INTERVAL seconds until all servers are finished
+# adaptive = search for each server's rate limit with runAdaptive() instead of running every case
+# resume = journal servers dict to continue from, see journal.py
+async def runCases(cases, subjects, adaptive=False, resume=None):
+  if adaptive:
+    servers = asyncio.gather(*[runAdaptive(cases, sub) for sub in subjects])
+  else:
+    servers = asyncio.gather(*[runServer(cases, sub, resume=(resume or {}).get(sub[0])) for sub in subjects])
+  while True:
+    event("ActiveTestThreads", value=sched.active)
+    try:
+      await asyncio.wait_for(asyncio.shield(servers), STATUS_INTERVAL)
+      break
+    except asyncio.TimeoutError:
+      pass
+    except asyncio.CancelledError: # Stopped by euthanize(), collect the servers before the loop closes
+      servers.cancel()
+      await asyncio.gather(servers, return_exceptions=True)
+      raise
+  event("ActiveTestThreads", value=sched.active)
+
+  euthanize('END', None)
+
+
+# Write the pending debug store block once it is dbgStore.FLUSH_INTERVAL seconds old
+async def dbgFlush():
+  while True:
+    await asyncio.sleep(dbgStore.FLUSH_INTERVAL / 4)
+    if df and not DYING:
+      df.flushDue()
+
+
+# Install signal handlers, DNS cache, RDAP connection pool, Scheduler, metrics and debug store flushes
+# servers = whois servers resolved before the first query, RDAP base URLs are left to the pool
+async def start(servers):
+  loop = asyncio.get_running_loop()
+  for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGABRT, signal.SIGALRM, signal.SIGSEGV, signal.SIGHUP]:
+    loop.add_signal_handler(sig, euthanize, sig, None)
+
+  global resolver, rdapPool, rdapThreads
+  resolver = dnsCache.DnsCache()
+  await resolver.resolveAll([s for s in servers if not rdapClient.isRdap(s)])
+  rdapPool = httpPool.HttpPool(TIMEOUT)
+  rdapThreads = concurrent.futures.ThreadPoolExecutor(RDAP_THREADS)
+  loop.create_task(resolver.refresh())
+  loop.create_task(dbgFlush())
+
+  global sched
+  sched = Scheduler(WORKERS)
+  loop.create_task(sched.run())
+
+  global stats
+  stats = metrics.Metrics({'writer_queue_depth': lambda: rf.depth() if rf else 0,
+                          'active_jobs': lambda: sched.active,
+                          'scheduler_heap_size': lambda: len(sched.heap)})
+  if metricsAddr:
+    await stats.serve(*metricsAddr)
+
+
+async def main(subjects, adaptive, resume=None):
+  await start([sub[0] for sub in subjects])
+  if jnl:
+    asyncio.get_running_loop().create_task(jnl.run())
+  await runCases(TESTS, subjects, adaptive, resume)
+
+
+# Run subjects handed out by the coordinator at address host:port, see fleet.py
+# Results are streamed to the coordinator, debug responses stay in the local store
+async def runWorker(host, port, node, slots):
+  await start([])
+  reader, writer = await asyncio.open_connection(host, port, limit=fleet.LINE_LIMIT)
+  global rf
+  rf = fleet.RemoteWriter(writer)
+  fleet.send(writer, {'type': 'hello', 'node': node, 'slots': slots})
+  asyncio.get_running_loop().create_task(heartbeat(writer))
+
+  tasks = set()
+  while True:
+    msg = await fleet.recv(reader)
+    if msg is None or msg['type'] == 'end':
+      break
+    if msg['type'] == 'subject':
+      task = asyncio.ensure_future(runSubject(writer, msg))
+      tasks.add(task)
+      task.add_done_callback(tasks.discard)
+
+  await writer.drain()
+  euthanize('END' if msg else 'coordinator lost', None)
+
+
+# Run one subject message from the coordinator and report its progress
+# A requeued subject carries a resume of its first case like a journal entry, see fleet.py
+async def runSubject(writer, msg):
+  global CASE_GAP, LIMIT_WINDOW
+  CASE_GAP = msg['caseGap']
+  LIMIT_WINDOW = msg['limitWindow']
+  server = msg['line'][0]
+  if not rdapClient.isRdap(server):
+    await resolver.resolveAll([server])
+    server = resolver.canonical(server)
+  rf.ids[server] = msg['id']
+  if msg['adaptive']:
+    await runAdaptive(msg['cases'], msg['line'])
+  else:
+    await runServer(msg['cases'], msg['line'],
+                      lambda case: fleet.send(writer, {'type': 'case', 'id': msg['id'], 'case': case}),
+                      msg.get('resume'))
+  if not DYING:
+    fleet.send(writer, {'type': 'done', 'id': msg['id']})
 
 
-# Prints error and usage then exits
-def usage(s):
-  print(s)
-  print("wrl.py CSV")
-  exit(0)
+async def heartbeat(writer):
+  while True:
+    await asyncio.sleep(fleet.HEARTBEAT)
+    fleet.send(writer, {'type': 'ping'})
 
 
-# Run through our test cases
-# Check every TIMEOUT seconds minimum if test cases are still running, if not start next case
-def runCases(cases, subjects, sleepTime):
-  if DYING:
-    return
+# Hand subjects to workers connecting on host:port and write their results, see fleet.py
+async def runCoordinator(subjects, adaptive, host, port, minWorkers):
+  loop = asyncio.get_running_loop()
+  for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGABRT, signal.SIGALRM, signal.SIGSEGV, signal.SIGHUP]:
+    loop.add_signal_handler(sig, euthanize, sig, None)
 
-  activeTestThreads = 0
-  for thr in threading.enumerate():
-    if isinstance(thr, WrlThr) or isinstance(thr, threading.Timer):
-      if thr.name != 'Timer_runCases':
-        activeTestThreads += 1
-
-  out("ActiveTestThreads:" + str(activeTestThreads))
-  if activeTestThreads > 0:
-    t = threading.Timer(sleepTime, runCases, args=[cases, subjects, max(int(sleepTime/2), TIMEOUT)])
-    t.name = type(t).__name__ + "_runCases"
-    t.start()
-  else:
-    if len(cases) > 0:
-      for sub in subjects:
-        WrlThr(sub[0], sub[1:], cases[0][0], cases[0][1], cases[0][2]).start()
-      random.shuffle(subjects)
-      runCases(cases[1:], subjects, int((cases[0][1] * (cases[0][2] + 1) / 2) + TIMEOUT))
-    else:
-      euthanize('END', None)
+  coord = fleet.Coordinator(subjects, TESTS, rf, adaptive, CASE_GAP, minWorkers, LIMIT_WINDOW)
+  await coord.serve(host, port)
+  euthanize('END', None)
 
 
 # Die gracefully
 def euthanize(signal, frame):
+  global DYING
+  if DYING:
+    return
   print(str(signal) + " exiting")
 
   # Set global dying flag
-  global DYING
   DYING = True
-  
-  # Kill all timer threads
-  for thr in threading.enumerate():
-    if isinstance(thr, threading.Timer):
-      try:
-        thr.cancel()
-      except:
-        pass
-
-  # Close open files
+
+  # Drop all queued queries
+  if sched:
+    sched.heap.clear()
+
+  # Record where every server got to
+  if jnl:
+    jnl.write(snapshot())
+
+  # Close open files, writing the pending debug store block
   global df, rf
-  df.close()
-  rf.close()
-  
-  sys.exit(0)
+  if df:
+    df.close()
+  if rf: # A worker has none until it connects
+    rf.close()
+
+  # Stop the main task, asyncio.run() then cancels the other tasks and closes the loop
+  if mainTask:
+    mainTask.cancel()
+
+
+# Run coroutine coro until it returns or euthanize() cancels it
+def runLoop(coro):
+  async def run():
+    global mainTask
+    mainTask = asyncio.current_task()
+    await coro
+
+  try:
+    asyncio.run(run())
+  except asyncio.CancelledError:
+    pass
 
 
 ###################
 # BEGIN EXECUTION #
 ###################
 
-if(len(sys.argv) < 2):
-  usage("Too few arguments")
-elif(len(sys.argv) > 2):
-  usage("Too many arguments")
+ap = argparse.ArgumentParser(description='Measure whois rate limiting of the servers in a subject CSV')
+ap.add_argument('subjects', type=str, nargs='?', default=None,
+                  help='CSV of whois server followed by domains to query, one server per line')
+ap.add_argument('-a', '--adaptive', action='store_true', default=False,
+                  help='Search for each server\'s rate limit instead of running every case')
+ap.add_argument('-C', '--coordinator', metavar='[HOST:]PORT', dest='coordinator', type=str, default=None,
+                  help='Hand the subjects to workers connecting here, HOST defaults to 127.0.0.1, and write their results instead of querying')
+ap.add_argument('-W', '--worker', metavar='HOST:PORT', dest='worker', type=str, default=None,
+                  help='Query the subjects handed out by the coordinator at this address')
+ap.add_argument('-m', '--min-workers', dest='minWorkers', type=int, default=1,
+                  help='Workers the coordinator waits for before handing out subjects')
+ap.add_argument('--slots', dest='slots', type=int, default=fleet.SLOTS, help='Subjects a worker runs at once')
+ap.add_argument('--node', dest='node', type=str, default=os.uname().nodename.split('.')[0],
+                  help='Name of this host in file names and worker records')
+ap.add_argument('-r', '--resume', metavar='JOURNAL', dest='resume', type=str, default=None,
+                  help='Continue the run recorded in JOURNAL, appending to its files')
+ap.add_argument('-M', '--metrics', metavar='[HOST:]PORT', dest='metrics', type=str, default=None,
+                  help='Serve live counters at /metrics (Prometheus) and /metrics.json, HOST defaults to 127.0.0.1')
+ap.add_argument('--cases', metavar='CASE[,CASE...]', dest='cases', type=str, default=None,
+                  help='Run only these cases of TESTS')
+ap.add_argument('--speedup', metavar='FACTOR', dest='speedup', type=float, default=1,
+                  help='Divide case delays and the gap between cases by FACTOR, for benchmarks against whoisFarm.py')
+args = ap.parse_args()
+if args.worker and (args.subjects or args.coordinator):
+  ap.error('a worker takes its subjects from the coordinator')
+if not args.worker and not args.subjects:
+  ap.error('subjects CSV is required')
+if args.resume and (args.adaptive or args.coordinator or args.worker or args.cases or args.speedup != 1):
+  ap.error('only runs of the full case ladder can be resumed')
+if args.metrics and args.coordinator:
+  ap.error('the coordinator sends no queries, serve metrics from its workers')
+if args.metrics:
+  host, _, port = args.metrics.rpartition(':')
+  metricsAddr = (host or '127.0.0.1', int(port))
+if args.cases:
+  TESTS = [t for t in TESTS if t[0] in args.cases.split(',')]
+  if not TESTS:
+    ap.error('no such cases')
+if args.speedup != 1:
+  TESTS = [[case, delay / args.speedup, cnt] for case, delay, cnt in TESTS]
+  CASE_GAP /= args.speedup
+  LIMIT_WINDOW /= args.speedup
+
+resume = None
+if args.resume:
+  resume = journal.load(args.resume)
+  fname = resume['fname']
+elif args.worker:
+  fname = args.node + "_worker_" + datetime.datetime.now().strftime("%Y_%m_%d") + ".txt"
+else:
+  fname = args.node + "_" + args.subjects.split('.')[0] + "_" + datetime.datetime.now().strftime("%Y_%m_%d") + ".txt"
+mode = 'a' if resume else 'w'
+
+# The journal is kept for plain runs of the case ladder
+if not (args.adaptive or args.coordinator or args.worker):
+  jnl = journal.Journal(args.resume or JOURNAL_PREFIX + fname.rsplit('.', 1)[0] + '.json', fname, snapshot)
+
+df = None
+if not args.coordinator:
+  df = dbgStore.DbgStore(DEBUG_PREFIX + fname.rsplit('.', 1)[0], mode=mode)
+if args.worker:
+  rf = None # Set once connected
+elif RESULTS_FORMAT == 'text':
+  rf = resWriter.ResWriter(RESULTS_PREFIX + fname, 'text', mode)
 else:
-  signal.signal(signal.SIGINT, euthanize)
-  signal.signal(signal.SIGTERM, euthanize)
-  signal.signal(signal.SIGABRT, euthanize)
-  signal.signal(signal.SIGALRM, euthanize)
-  signal.signal(signal.SIGSEGV, euthanize)
-  signal.signal(signal.SIGHUP, euthanize)
+  rf = resWriter.ResWriter(RESULTS_PREFIX + fname.rsplit('.', 1)[0] + '.jsonl', 'json', mode)
 
-  fname = os.uname().nodename.split('.')[0] + "_" + sys.argv[1].split('.')[0] + "_" + datetime.datetime.now().strftime("%Y_%m_%d") + ".txt"
+if os.path.exists(PROFILE_FILE):
+  classifier = classify.load(PROFILE_FILE)
+else:
+  classifier = classify.Classifier()
 
-  df = open(DEBUG_PREFIX + fname, 'w', 1)
-  rf = open(RESULTS_PREFIX + fname, 'w', 1)
+random.seed()
+if args.worker:
+  host, _, port = args.worker.rpartition(':')
+  runLoop(runWorker(host, int(port), args.node, args.slots))
 
-  random.seed()
+else:
   subjects = []
-  with open(sys.argv[1], 'r') as f:
+  with open(args.subjects, 'r') as f:
     for line in f.read().split('\n'):
       if len(line) > 0:
         subjects.append(line.strip('\n').split(','))
   f.closed
 
   random.shuffle(subjects)
-  runCases(TESTS, subjects, None)
+  if args.coordinator:
+    host, _, port = args.coordinator.rpartition(':')
+    runLoop(runCoordinator(subjects, args.adaptive, host or '127.0.0.1', int(port), args.minWorkers))
+  else:
+    runLoop(main(subjects, args.adaptive, resume['servers'] if resume else None))